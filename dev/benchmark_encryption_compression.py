@@ -0,0 +1,55 @@
+import logging
+logging.basicConfig(format='%(asctime)s.%(msecs)05d | %(levelname)s | %(filename)s:%(lineno)d | %(message)s' , datefmt='%FY%T')
+logger = logging.getLogger()
+logger.setLevel(logging.WARNING)
+
+import io
+import os
+import sys
+import glob
+import time
+import zlib
+import base64
+
+sys.path.append(f"{os.getcwd()}/src")
+
+from encryption.service import EncryptService
+from image_processing.service import ImageProcessingService
+
+REPETITIONS = 10
+PUBLIC_KEY_LOCATION = os.environ.get("PUBLIC_KEY_LOCATION", ".local/data.pub")
+PRIVATE_KEY_LOCATION = os.environ.get("PRIVATE_KEY_LOCATION", ".local/data")
+
+def get_upload_values(image_path: str) -> dict:
+    # The values of a single upload - the original and its thumbnail
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+        thumbnail_bytes = ImageProcessingService().process_image(image_file).thumbnail.data
+    return {"image": image_bytes, "thumbnail": thumbnail_bytes}
+
+def zlib_every_value(encrypt_service: EncryptService, values: dict) -> dict:
+    # The compression before the policy - zlib with the default level on every value, then the encryption
+    return encrypt_service.encrypt({key: zlib.compress(value) for key, value in values.items()})[0]
+
+def measure(encrypt_function, values: dict):
+    start_time = time.process_time()
+    for _ in range(REPETITIONS):
+        result = encrypt_function(values)
+    cpu_time_ms = (time.process_time()-start_time)*1000/REPETITIONS
+    result_size = sum([len(value) if type(value) is bytes else len(base64.b64decode(value[len("b64:"):])) for value in result.values()])
+    return cpu_time_ms, result_size
+
+if __name__ == "__main__":
+    encrypt_services = {compression: EncryptService(public_key_location=PUBLIC_KEY_LOCATION,
+                                                    private_key_location=PRIVATE_KEY_LOCATION,
+                                                    compression=compression) for compression in ["NONE", "ZLIB", "ZSTD"]}
+    images_paths = sorted(glob.glob(f"{os.getcwd()}/tests/data/*.jpg"))
+    print(f"{'image':<25}{'mode':>14}{'CPU [ms]':>12}{'bytes':>12}")
+    for image_path in images_paths:
+        values = get_upload_values(image_path)
+        print(f"{os.path.basename(image_path):<25}{'plain':>14}{'':>12}{sum([len(value) for value in values.values()]):>12}")
+        cpu_time_ms, result_size = measure(lambda values: zlib_every_value(encrypt_services["NONE"], values), values)
+        print(f"{os.path.basename(image_path):<25}{'zlib always':>14}{cpu_time_ms:>12.2f}{result_size:>12}")
+        for compression, encrypt_service in encrypt_services.items():
+            cpu_time_ms, result_size = measure(lambda values: encrypt_service.encrypt(values)[0], values)
+            print(f"{os.path.basename(image_path):<25}{'policy '+compression.lower():>14}{cpu_time_ms:>12.2f}{result_size:>12}")
@@ -0,0 +1,62 @@
+import logging
+logging.basicConfig(format='%(asctime)s.%(msecs)05d | %(levelname)s | %(filename)s:%(lineno)d | %(message)s' , datefmt='%FY%T')
+logger = logging.getLogger()
+logger.setLevel(logging.WARNING)
+
+import os
+import sys
+import json
+import time
+import pickle
+from typing import List
+
+sys.path.append(f"{os.getcwd()}/src")
+
+from db.media_service import MediaDBService
+from models.media import MediaDB, SearchResult
+
+REPETITIONS = 20
+PAGE_SIZE = 1000
+SEARCH_RESULT_LOCATION = f"{os.getcwd()}/tests/data/media_data_07122023191705.pickle"
+
+class InitOverrideMediaDB(MediaDB):
+    # The MediaDB before the decode path change - the __init__ override makes pydantic validate through python
+    def __init__(self, **karg):
+        MediaDB.__init__(self,**karg)
+
+class InitOverrideSearchResult(SearchResult):
+    results: List[InitOverrideMediaDB]
+
+def get_search_response_content() -> bytes:
+    # A full page of the fixture's media, as the media db sends it
+    with open(SEARCH_RESULT_LOCATION, "rb") as search_result_file:
+        search_result = pickle.load(search_result_file)
+    fixture_results = search_result["results"]
+    results = [dict(fixture_results[result_index % len(fixture_results)], media_id=f"media_{result_index}") for result_index in range(PAGE_SIZE)]
+    return SearchResult(total_results_number=len(results), page_size=PAGE_SIZE, results=results).model_dump_json().encode()
+
+def measure(decode_function, response_content: bytes) -> float:
+    start_time = time.process_time()
+    for _ in range(REPETITIONS):
+        decode_function(response_content)
+    return (time.process_time()-start_time)*1000/REPETITIONS
+
+if __name__ == "__main__":
+    response_content = get_search_response_content()
+    decode_paths = {
+        "json + SearchResult(**) with __init__": lambda content: InitOverrideSearchResult(**json.loads(content)),
+        "json + SearchResult(**)": lambda content: SearchResult(**json.loads(content)),
+        "model_validate_json": lambda content: SearchResult.model_validate_json(content),
+        "search_media decode (json + model_validate)": lambda content: MediaDBService.__parse_search_response__(200, content, None),
+    }
+    print(f"Decode of a {PAGE_SIZE} media page ({len(response_content)/1024:.0f} KiB)")
+    print(f"{'Decode path':<48}{'CPU ms':>10}")
+    for decode_name, decode_function in decode_paths.items():
+        print(f"{decode_name:<48}{measure(decode_function, response_content):>10.1f}")
+    # The db sends only the projected columns
+    projection_fields = ["media_id", "media_name", "device_media_uri"]
+    projection_content = json.dumps({"total_results_number": PAGE_SIZE,
+                                     "results": [{field_name: media[field_name] for field_name in projection_fields}
+                                                 for media in json.loads(response_content)["results"]]}).encode()
+    projection_time_ms = measure(lambda content: MediaDBService.__parse_search_response__(200, content, projection_fields), projection_content)
+    print(f"{'projection of 3 fields':<48}{projection_time_ms:>10.1f}")
@@ -0,0 +1,44 @@
+import logging
+logging.basicConfig(format='%(asctime)s.%(msecs)05d | %(levelname)s | %(filename)s:%(lineno)d | %(message)s' , datefmt='%FY%T')
+logger = logging.getLogger()
+logger.setLevel(logging.WARNING)
+
+import io
+import os
+import sys
+import glob
+import time
+import base64
+
+sys.path.append(f"{os.getcwd()}/src")
+
+from PIL import Image, features
+from image_processing.service import ImageProcessingService
+
+REPETITIONS = 10
+THUMBNAIL_SIZE = (500, 500)
+QUALITIES = [50, 75, 90]
+
+def get_codecs() -> list:
+    return ["JPEG"] + [codec for codec in ["WEBP", "AVIF"] if features.check(codec.lower())]
+
+def measure(image: Image, codec: str, quality: int):
+    start_time = time.perf_counter()
+    for _ in range(REPETITIONS):
+        thumbnail_bytes = ImageProcessingService.encode_image(image, codec, quality)
+    encode_time_ms = (time.perf_counter()-start_time)*1000/REPETITIONS
+    # The thumbnails are returned to the clients as base64
+    return len(thumbnail_bytes), len(base64.b64encode(thumbnail_bytes)), encode_time_ms
+
+if __name__ == "__main__":
+    images_paths = sorted(glob.glob(f"{os.getcwd()}/tests/data/*.jpg"))
+    print(f"{'image':<25}{'codec':>8}{'quality':>9}{'bytes':>10}{'base64 bytes':>14}{'encode [ms]':>13}")
+    for image_path in images_paths:
+        with Image.open(image_path) as image:
+            image.draft("RGB", THUMBNAIL_SIZE)
+            image.thumbnail(THUMBNAIL_SIZE)
+            thumbnail_image = image.convert("RGB")
+        for codec in get_codecs():
+            for quality in QUALITIES:
+                thumbnail_size, base64_size, encode_time_ms = measure(thumbnail_image, codec, quality)
+                print(f"{os.path.basename(image_path):<25}{codec:>8}{quality:>9}{thumbnail_size:>10}{base64_size:>14}{encode_time_ms:>13.2f}")
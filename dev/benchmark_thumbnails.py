@@ -0,0 +1,67 @@
+import logging
+logging.basicConfig(format='%(asctime)s.%(msecs)05d | %(levelname)s | %(filename)s:%(lineno)d | %(message)s' , datefmt='%FY%T')
+logger = logging.getLogger()
+logger.setLevel(logging.WARNING)
+
+import io
+import os
+import sys
+import glob
+import time
+import resource
+import multiprocessing
+
+sys.path.append(f"{os.getcwd()}/src")
+
+from PIL import Image
+from image_processing.service import ImageProcessingService
+
+REPETITIONS = 10
+# Both modes produce the same thumbnail, so the comparison measures the decoding only
+THUMBNAIL_WIDTH = 400
+THUMBNAIL_HEIGHT = 400
+THUMBNAIL_FORMAT = "JPEG"
+THUMBNAIL_QUALITY = 75
+
+def full_decode_thumbnail(image_path: str):
+    # The thumbnail creation before the scaled decoding - full decode at native resolution, then resize
+    with open(image_path, "rb") as image_file:
+        temp_image = Image.open(image_file)
+        temp_image = temp_image.resize(ImageProcessingService.fit_size(temp_image.size, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT))
+        mem_file = io.BytesIO()
+        temp_image.save(mem_file, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        return mem_file.getvalue()
+
+def scaled_decode_thumbnail(image_path: str):
+    with open(image_path, "rb") as image_file:
+        return ImageProcessingService(thumbnail_width_size=THUMBNAIL_WIDTH,
+                                      thumbnail_height_size=THUMBNAIL_HEIGHT,
+                                      thumbnail_format=THUMBNAIL_FORMAT,
+                                      thumbnail_quality=THUMBNAIL_QUALITY).get_image_thumbnail_bytes(image_file)[0]
+
+def measure(thumbnail_function, image_path: str, results_queue):
+    # Runs in its own process, so ru_maxrss is the peak of this measurement only
+    start_time = time.perf_counter()
+    for _ in range(REPETITIONS):
+        thumbnail_function(image_path)
+    latency_ms = (time.perf_counter()-start_time)*1000/REPETITIONS
+    results_queue.put((latency_ms, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024))
+
+def run_measurement(thumbnail_function, image_path: str):
+    context = multiprocessing.get_context("spawn")
+    results_queue = context.Queue()
+    process = context.Process(target=measure, args=(thumbnail_function, image_path, results_queue))
+    process.start()
+    results = results_queue.get()
+    process.join()
+    return results
+
+if __name__ == "__main__":
+    images_paths = sorted(glob.glob(f"{os.getcwd()}/tests/data/*.jpg"))
+    print(f"{'image':<25}{'size':>12}{'mode':>8}{'latency [ms]':>15}{'peak RSS [MB]':>15}")
+    for image_path in images_paths:
+        with Image.open(image_path) as image:
+            image_size = f"{image.size[0]}x{image.size[1]}"
+        for mode_name, thumbnail_function in [("full", full_decode_thumbnail), ("scaled", scaled_decode_thumbnail)]:
+            latency_ms, peak_rss_mb = run_measurement(thumbnail_function, image_path)
+            print(f"{os.path.basename(image_path):<25}{image_size:>12}{mode_name:>8}{latency_ms:>15.2f}{peak_rss_mb:>15.1f}")
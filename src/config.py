@@ -19,14 +19,40 @@ class ApplicationConfiguration:
     MEDIA_REPO_PORT: str = "4432"
     USER_DB_HOST: str = "10.0.0.5"
     USER_DB_PORT: str = "24430"
+    HTTP_POOL_CONNECTIONS: int = 10 # Hosts with a kept-alive connection pool
+    HTTP_POOL_MAXSIZE: int = 20 # Kept-alive connections per host
+    HTTP_CONNECT_TIMEOUT: float = 3.05 # seconds
+    HTTP_READ_TIMEOUT: float = 30 # seconds
+    MEDIA_DB_PARALLEL_PAGES: int = 4 # Search pages fetched at once by the full scans
+
+    # Upload Processing Parameters
+    UPLOAD_SPOOL_LOCATION: str = "/temp/upload_spool"
+    UPLOAD_JOBS_WORKERS: int = 4
+    UPLOAD_JOB_TIMEOUT: float = 600 # seconds a background job waits for its processing
+    UPLOAD_BATCH_WORKERS: int = 4
+    UPLOAD_CPU_WORKERS: int = 4 # Threads of the hashing, thumbnail and encryption stages
+    UPLOAD_SESSION_TTL: int = 24
 
     # Image Processing Parameters
     THUMBNAIL_MAX_WIDTH: int = 500
     THUMBNAIL_MAX_HEIGHT: int = 500
+    THUMBNAIL_FORMAT: str = "JPEG" # AVIF, WEBP or JPEG. WebP is ~7% smaller but ~30x slower to encode (dev/benchmark_thumbnail_codecs.py)
+    THUMBNAIL_QUALITY: int = 75
+    THUMBNAIL_RENDITIONS: str = "grid:256x256,blur:32x32:2" # name:WIDTHxHEIGHT[:BLUR_RADIUS],...
+    THUMBNAIL_PROCESS_POOL_SIZE: int = 0
+    THUMBNAIL_MAX_IMAGE_MEGAPIXELS: float = 250 # Bigger images are rejected before they are decoded
+    THUMBNAIL_STRIP_DECODE_MEGAPIXELS: float = 50 # Bigger uncompressed images are downscaled strip by strip
+    THUMBNAIL_MEGAPIXELS_BUDGET: float = 0 # Decoded megapixels of all the images processed at once, 0 is unlimited
+    NEAR_DUPLICATES_INDEX_TTL: int = 600 # seconds
 
     # Encryption Configuration Values
     PUBLIC_KEY_LOCATION: str = ".local/data.pub"
     PRIVATE_KEY_LOCATION: str = ".local/data"
+    ENCRYPTION_CHUNK_SIZE: int = 1024*1024
+    ENCRYPTION_CIPHER: str = "AES-GCM" # AES-GCM or CHACHA20-POLY1305
+    ENCRYPTION_COMPRESSION: str = "ZSTD" # ZSTD, ZLIB or NONE. Already compressed media is never compressed
+    ENCRYPTION_COMPRESSION_LEVEL: int = 3
+    ENCRYPTION_WORKERS: int = 4
     
     def __init__(self) -> None:
         self.logger = logging.getLogger()
@@ -1,71 +1,183 @@
 import logging
 logger = logging.getLogger(__name__)
-from typing import List
+import asyncio
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Iterator, AsyncIterator
 from fastapi import Request
-import requests
 import json
 from pydantic import BaseModel
 
 from authentication.models import Token
-from models.media import MediaRequest, MediaDB, SearchResult
+from http_transport.service import HttpTransport, AsyncHttpTransport
+from models.media import MediaRequest, MediaDB, SearchResult, ProjectedSearchResult, BatchInsertResult
 
 class MediaDBService:
+    """Blocking client of the media search, for the services that run in worker threads (near duplicates index).
+    The routes use AsyncMediaDBService, both build the search request and parse its response with the helpers of this class
+    """
 
     def __init__(self,
                  host: str,
                  port: str | int,
-                 connection_timeout: int=10
+                 connection_timeout: int=10,
+                 transport: HttpTransport | None=None,
+                 parallel_pages: int=4
                  ) -> None:
         self.service_url = f"http://{host}:{str(port)}"
         self.connection_timeout = connection_timeout
-       
-    def is_ready(self):
-        raise NotImplementedError("Is it necessary?")
+        self.transport = transport if transport else HttpTransport(connect_timeout=connection_timeout)
+        self.parallel_pages = parallel_pages
+        self.executor = ThreadPoolExecutor(max_workers=parallel_pages, thread_name_prefix="media_search")
 
-    def insert_media(self, token: Token, media: MediaRequest) -> MediaDB:
+    def search_media(self, token: Token, fields: List[str] | None=None, **kargs) -> SearchResult | ProjectedSearchResult:
+        """Search the media by the field values in kargs
+
+        With fields, the db selects only these columns and the results are projections (MediaDB.get_projection_model)
+        """
+        search_url = self.service_url+"/v1/media/search"
+        search_response = self.transport.get(search_url, params=MediaDBService.__get_search_params__(fields, kargs), headers=token.get_token_as_header())
+        return MediaDBService.__parse_search_response__(search_response.status_code, search_response.content, fields)
+
+    @staticmethod
+    def __get_search_params__(fields: List[str] | None, kargs: dict) -> dict:
+        if fields:
+            kargs["fields"] = fields
+        return kargs
+
+    @staticmethod
+    def __parse_search_response__(status_code: int, response_content: bytes, fields: List[str] | None) -> SearchResult | ProjectedSearchResult:
+        result_model = ProjectedSearchResult if fields else SearchResult
+        if status_code == 404:
+            return result_model(total_results_number=0, results=[])
+        if status_code != 200:
+            raise Exception(json.loads(response_content)["detail"])
+        # Validating the parsed dicts measured faster than model_validate_json on this pydantic version (dev/benchmark_search_decode.py)
+        if fields:
+            result_model = ProjectedSearchResult[MediaDB.get_projection_model(tuple(fields))]
+        return result_model.model_validate(json.loads(response_content))
+
+    def search_media_all(self, token: Token, page_size: int=1000, **kargs) -> Iterator[MediaDB]:
+        """Stream all the search results, in the order of the pages
+
+        The first page tells the number of pages, the rest are fetched parallel_pages at a time.
+        Pages are taken by number, so kargs should have an order_by that keeps the order stable between the requests
+        """
+        first_page = self.search_media(token=token, page_size=page_size, page_number=0, **kargs)
+        yield from first_page.results
+        pages_number = math.ceil(first_page.total_results_number/page_size)
+        pending_pages = deque()
+        try:
+            for page_number in range(1, pages_number):
+                pending_pages.append(self.executor.submit(self.search_media, token=token, page_size=page_size, page_number=page_number, **kargs))
+                if len(pending_pages) >= self.parallel_pages:
+                    yield from pending_pages.popleft().result().results
+            while pending_pages:
+                yield from pending_pages.popleft().result().results
+        finally:
+            # The consumer stopped early
+            for pending_page in pending_pages:
+                pending_page.cancel()
+
+class AsyncMediaDBService:
+    """The media db client of the async routes
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: str | int,
+                 connection_timeout: int=10,
+                 transport: AsyncHttpTransport | None=None,
+                 parallel_pages: int=4
+                 ) -> None:
+        self.service_url = f"http://{host}:{str(port)}"
+        self.connection_timeout = connection_timeout
+        self.transport = transport if transport else AsyncHttpTransport(connect_timeout=connection_timeout)
+        self.parallel_pages = parallel_pages
+
+    async def insert_media(self, token: Token, media: MediaRequest) -> MediaDB:
         content = media.model_dump_json()
 
         insert_url = self.service_url+"/v1/media"
-        insert_response = requests.put(insert_url,json=json.loads(content), headers=token.get_token_as_header())
+        insert_response = await self.transport.put(insert_url,json=json.loads(content), headers=token.get_token_as_header())
 
         if insert_response.status_code == 200:
-            return MediaDB(**insert_response.json())
+            return MediaDB.model_validate_json(insert_response.content)
         raise Exception(insert_response.json()["detail"])
-    
-    def get(self, token: Token, media_id) -> MediaDB:
+
+    async def insert_media_batch(self, token: Token, media_list: List[MediaRequest]) -> BatchInsertResult:
+        content = [json.loads(media.model_dump_json()) for media in media_list]
+
+        insert_url = self.service_url+"/v1/media/batch"
+        insert_response = await self.transport.put(insert_url,json=content, headers=token.get_token_as_header())
+
+        if insert_response.status_code == 200:
+            return BatchInsertResult.model_validate_json(insert_response.content)
+        raise Exception(insert_response.json()["detail"])
+
+    async def get(self, token: Token, media_id) -> MediaDB:
         insert_url = self.service_url+"/v1/media/"+media_id
-        insert_response = requests.get(insert_url, headers=token.get_token_as_header())
+        insert_response = await self.transport.get(insert_url, headers=token.get_token_as_header())
 
         if insert_response.status_code == 200:
-            return MediaDB(**insert_response.json())
-        raise Exception(insert_response.json()["details"])
-
-    def search_media(self, token: Token, **kargs) -> SearchResult:
-        insert_url = self.service_url+"/v1/media/search"
-        search_response = requests.get(insert_url,params=kargs, headers=token.get_token_as_header())
-
-        if search_response.status_code == 200:
-            return SearchResult(**search_response.json())
-        if search_response.status_code == 404:
-            return SearchResult(total_results_number=0, results=[])
-        raise Exception(search_response.json()["detail"])
-    
-    def delete(self, token: Token, media_id) -> MediaDB:
+            return MediaDB.model_validate_json(insert_response.content)
+        raise Exception(insert_response.json()["detail"])
+
+    async def search_media(self, token: Token, fields: List[str] | None=None, **kargs) -> SearchResult | ProjectedSearchResult:
+        """Search the media by the field values in kargs. See MediaDBService.search_media
+        """
+        search_url = self.service_url+"/v1/media/search"
+        search_response = await self.transport.get(search_url, params=MediaDBService.__get_search_params__(fields, kargs), headers=token.get_token_as_header())
+        return MediaDBService.__parse_search_response__(search_response.status_code, search_response.content, fields)
+
+    async def search_media_all(self, token: Token, page_size: int=1000, **kargs) -> AsyncIterator[MediaDB]:
+        """Stream all the search results, in the order of the pages. See MediaDBService.search_media_all
+        """
+        first_page = await self.search_media(token=token, page_size=page_size, page_number=0, **kargs)
+        for media in first_page.results:
+            yield media
+        pages_number = math.ceil(first_page.total_results_number/page_size)
+        pending_pages = deque()
+        try:
+            for page_number in range(1, pages_number):
+                pending_pages.append(asyncio.ensure_future(self.search_media(token=token, page_size=page_size, page_number=page_number, **kargs)))
+                if len(pending_pages) >= self.parallel_pages:
+                    for media in (await pending_pages.popleft()).results:
+                        yield media
+            while pending_pages:
+                for media in (await pending_pages.popleft()).results:
+                    yield media
+        finally:
+            # The consumer stopped early
+            for pending_page in pending_pages:
+                pending_page.cancel()
+
+    async def get_latest_media(self, token: Token, **kargs) -> MediaDB | None:
+        search_result = await self.search_media(token=token, order_by="created_on", order_direction="desc", page_size=1, **kargs)
+        if len(search_result.results)==0:
+            return None
+        return search_result.results[0]
+
+    async def get_media_by_hash(self, token: Token, content_hash: str, **kargs) -> MediaDB | None:
+        search_result = await self.search_media(token=token, content_hash=content_hash, upload_status="UPLOADED", page_size=1, **kargs)
+        if len(search_result.results)==0:
+            return None
+        return search_result.results[0]
+
+    async def delete(self, token: Token, media_id) -> MediaDB:
         insert_url = self.service_url+"/v1/media/"+media_id
-        insert_response = requests.delete(insert_url, headers=token.get_token_as_header())
+        insert_response = await self.transport.delete(insert_url, headers=token.get_token_as_header())
 
         if insert_response.status_code == 200:
-            return MediaDB(**insert_response.json())
+            return MediaDB.model_validate_json(insert_response.content)
         raise Exception(insert_response.json()["detail"])
-    
-    def update(self, token: Token, media: MediaDB):
+
+    async def update(self, token: Token, media: MediaDB):
         insert_url = self.service_url+"/v1/media/"+media.media_id
         content = media.model_dump_json()
-        insert_response = requests.post(insert_url, json=json.loads(content), headers=token.get_token_as_header())
+        insert_response = await self.transport.post(insert_url, json=json.loads(content), headers=token.get_token_as_header())
 
         if insert_response.status_code == 200:
-            return MediaDB(**insert_response.json())
+            return MediaDB.model_validate_json(insert_response.content)
         raise Exception(insert_response.json()["detail"])
-
-
-        
@@ -2,29 +2,30 @@ import logging
 logger = logging.getLogger(__name__)
 from typing import List
 from fastapi import Request
-import requests
 import json
 from pydantic import BaseModel
 
 from authentication.models import Token
+from http_transport.service import AsyncHttpTransport
 from models.user import UserDB, UserRequest, User
 from models.device import Device, DeviceRequest
 
-class UserDBService:
+class AsyncUserDBService:
+    """The user db client of the async routes
+    """
 
     def __init__(self,
                  host: str,
                  port: str | int,
-                 connection_timeout: int=10
+                 connection_timeout: int=10,
+                 transport: AsyncHttpTransport | None=None
                  ) -> None:
         self.service_url = f"http://{host}:{str(port)}"
         self.connection_timeout = connection_timeout
+        self.transport = transport if transport else AsyncHttpTransport(connect_timeout=connection_timeout)
 
-    def is_ready(self):
-        raise NotImplementedError("Is it necessary?")
+    async def insert_user(self, user: UserRequest) -> User:
 
-    def insert_user(self, user: UserRequest) -> User:
-        
         insert_url = self.service_url+"/user"
 
         content = {
@@ -32,17 +33,17 @@ class UserDBService:
             "password": user.password
         }
 
-        insert_response = requests.put(insert_url, json=content)
+        insert_response = await self.transport.put(insert_url, json=content)
 
         if insert_response.status_code == 200:
-            return User(**insert_response)
+            return User(**insert_response.json())
         raise Exception(insert_response.json()["detail"])
 
-    def login_user(self, user: UserRequest) -> Token:
-        
+    async def login_user(self, user: UserRequest) -> Token:
+
         login_url = self.service_url+"/login"
 
-        login_response = requests.post(login_url, data=user.model_dump())
+        login_response = await self.transport.post(login_url, data=user.model_dump())
 
         if login_response.status_code == 200:
             return Token(**login_response.json())
@@ -50,21 +51,21 @@ class UserDBService:
             raise Exception("Permission Denied")
         raise Exception(login_response.json()["detail"])
 
-    def search_user(self, token: Token, **kargs) -> User:
-        
+    async def search_user(self, token: Token, **kargs) -> User:
+
         search_user_url = self.service_url+"/user"
 
-        search_user_response = requests.get(search_user_url, params=kargs, headers=token.get_token_as_header())
+        search_user_response = await self.transport.get(search_user_url, params=kargs, headers=token.get_token_as_header())
 
         if search_user_response.status_code == 200:
             return User(**search_user_response.json())
         raise Exception(search_user_response.json()["detail"])
 
-    def search_device(self, token: Token, **kargs) -> List[Device]:
-        
+    async def search_device(self, token: Token, **kargs) -> List[Device]:
+
         search_device_url = self.service_url+"/device/search"
 
-        search_device_response = requests.get(search_device_url, params=kargs, headers=token.get_token_as_header())
+        search_device_response = await self.transport.get(search_device_url, params=kargs, headers=token.get_token_as_header())
 
         if search_device_response.status_code == 200:
             devices = search_device_response.json()
@@ -75,12 +76,12 @@ class UserDBService:
         if search_device_response.status_code == 404:
             return []
         raise Exception(search_device_response.json()["detail"])
-    
-    def get_device(self, token: Token, device_id) -> Device | None:
-        
+
+    async def get_device(self, token: Token, device_id) -> Device | None:
+
         get_device_url = self.service_url+f"/device/{device_id}"
 
-        get_device_response = requests.get(get_device_url, headers=token.get_token_as_header())
+        get_device_response = await self.transport.get(get_device_url, headers=token.get_token_as_header())
 
         if get_device_response.status_code == 200:
             return Device(**get_device_response.json())
@@ -88,13 +89,12 @@ class UserDBService:
             return None
         raise Exception(get_device_response.json()["detail"])
 
-    def insert_device(self, token: Token, device_request: DeviceRequest) -> Device:
-        
+    async def insert_device(self, token: Token, device_request: DeviceRequest) -> Device:
+
         insert_device_url = self.service_url+"/device"
 
-        insert_device_response = requests.put(insert_device_url, json=device_request.model_dump(), headers=token.get_token_as_header())
+        insert_device_response = await self.transport.put(insert_device_url, json=device_request.model_dump(), headers=token.get_token_as_header())
 
         if insert_device_response.status_code == 200:
             return Device(**insert_device_response.json())
         raise Exception(insert_device_response.json()["detail"])
-
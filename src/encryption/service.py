@@ -1,16 +1,59 @@
+import logging
+logger = logging.getLogger(__name__)
 import io
+import os
 import base64
 import zlib
 import json
+import struct
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, BinaryIO, List
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Envelope of all the encrypted values: header (magic, version, cipher, compression, chunk size, nonce prefix)
+# followed by frames of (ciphertext length, ciphertext). Every frame is a separately authenticated chunk.
+# Values that don't start with the magic are legacy Fernet tokens
+STREAM_MAGIC = b"SHKE"
+STREAM_VERSION = 1
+STREAM_HEADER_FORMAT = ">4sBBBI7s"
+STREAM_HEADER_SIZE = struct.calcsize(STREAM_HEADER_FORMAT)
+STREAM_FRAME_LENGTH_FORMAT = ">I"
+STREAM_FRAME_LENGTH_SIZE = struct.calcsize(STREAM_FRAME_LENGTH_FORMAT)
+CIPHER_AES_GCM = 1
+CIPHER_CHACHA20_POLY1305 = 2
+STREAM_CIPHERS = {CIPHER_AES_GCM: AESGCM, CIPHER_CHACHA20_POLY1305: ChaCha20Poly1305}
+CIPHERS_IDS = {"AES-GCM": CIPHER_AES_GCM, "CHACHA20-POLY1305": CIPHER_CHACHA20_POLY1305}
+SYMMETRIC_KEY_SIZE = 32 # Legacy keys are 44 bytes Fernet keys
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSIONS_IDS = {"NONE": COMPRESSION_NONE, "ZLIB": COMPRESSION_ZLIB, "ZSTD": COMPRESSION_ZSTD}
+# Formats that are already entropy coded (JPEG, PNG, GIF, zip, gzip, zstd, bzip2, xz, 7z), compressing them again gains nothing
+COMPRESSED_SIGNATURES = [b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"PK\x03\x04", b"\x1f\x8b", b"\x28\xb5\x2f\xfd", b"BZh", b"\xfd7zXZ", b"7z\xbc\xaf"]
 
 class EncryptService:
 
     def __init__(self,
                 public_key_location: str=None,
-                private_key_location: str=None) -> None:
+                private_key_location: str=None,
+                chunk_size: int=1024*1024,
+                cipher: str="AES-GCM",
+                compression: str="ZSTD",
+                compression_level: int=3,
+                compression_sample_size: int=64*1024,
+                min_compression_ratio: float=0.95,
+                workers_number: int=4) -> None:
         
         self.padding_function = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()),
                                 algorithm=hashes.SHA256(),
@@ -19,7 +62,27 @@ class EncryptService:
             self.public_key = self.__load_public_key__(public_key_location)
         if private_key_location:
             self.private_key_location = private_key_location
+        # The private key is parsed once and reloaded only when the key file changes
+        self.private_key = None
+        self.private_key_file_stat = None
+        self.private_key_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers_number, thread_name_prefix="encryption")
+        # Frames of a stream that are encrypted ahead of its consumer
+        self.parallel_frames = workers_number*2
         self.B64_PREFIX = "b64:"
+        self.chunk_size = chunk_size
+        if not cipher.upper() in CIPHERS_IDS:
+            raise AttributeError(f"Unsupported cipher {cipher}, use one of {list(CIPHERS_IDS.keys())}")
+        self.cipher_id = CIPHERS_IDS[cipher.upper()]
+        if not compression.upper() in COMPRESSIONS_IDS:
+            raise AttributeError(f"Unsupported compression {compression}, use one of {list(COMPRESSIONS_IDS.keys())}")
+        self.compression_id = COMPRESSIONS_IDS[compression.upper()]
+        if self.compression_id == COMPRESSION_ZSTD and zstandard is None:
+            logger.warning("zstandard isn't installed, compress with zlib")
+            self.compression_id = COMPRESSION_ZLIB
+        self.compression_level = compression_level
+        self.compression_sample_size = compression_sample_size
+        self.min_compression_ratio = min_compression_ratio
 
     def __load_public_key__(self,public_key_location) -> bytes:
         with open(public_key_location, "rb") as key_file:
@@ -27,16 +90,34 @@ class EncryptService:
         return loaded_public_key
 
     def __load_private_key__(self) -> bytes:
-        with open(self.private_key_location, "rb") as key_file:
-            loaded_private_key = serialization.load_pem_private_key(key_file.read(),
-                                                            password=None)
-        return loaded_private_key
+        key_file_stat = os.stat(self.private_key_location)
+        key_file_stat = (key_file_stat.st_mtime_ns, key_file_stat.st_size, key_file_stat.st_ino)
+        with self.private_key_lock:
+            if self.private_key is None or self.private_key_file_stat != key_file_stat:
+                with open(self.private_key_location, "rb") as key_file:
+                    self.private_key = serialization.load_pem_private_key(key_file.read(),
+                                                                          password=None)
+                self.private_key_file_stat = key_file_stat
+            return self.private_key
+
+    def encrypt(self, values_to_encrypt: dict[str,bytes | BinaryIO]) -> tuple:
+        """Encrypt all the values with the same symmetric key
 
-    def encrypt(self, values_to_encrypt: dict[str,bytes]) -> tuple:
+        bytes values are encrypted in memory. File values are encrypted lazily in chunks,
+        their result is an iterator over the encrypted stream that reads the file while it is consumed
+        """
         temp_dict = values_to_encrypt.copy()
-        encryptor, encrypted_key = self.__prepare_encryptor__()
+        symmetric_key, encrypted_key = self.__prepare_keys__()
+        stream_key = self.__derive_stream_key__(symmetric_key)
+        del symmetric_key
+        # The bytes values are independent, so they are encrypted in parallel (the cryptography primitives release the GIL)
+        futures = {key: self.executor.submit(lambda value: b"".join(self.__encrypt_stream__(stream_key, io.BytesIO(value))), value)
+                   for key, value in temp_dict.items() if not hasattr(value, "read")}
         for key, value in temp_dict.items():
-            temp_dict[key] = encryptor.encrypt(zlib.compress(value))
+            if hasattr(value, "read"):
+                temp_dict[key] = self.__encrypt_stream__(stream_key, value, parallel=True)
+                continue
+            temp_dict[key] = futures[key].result()
             if not key=="image":
                 try:
                     json.dumps(temp_dict[key])
@@ -44,23 +125,172 @@ class EncryptService:
                     temp_dict[key] = self.B64_PREFIX+base64.b64encode(temp_dict[key]).decode()
         return temp_dict, base64.b64encode(encrypted_key).decode()
 
+    def encrypt_stream(self, source_file: BinaryIO) -> tuple[Iterator[bytes], str]:
+        """Encrypt a single file with a new key. Returns the lazy encrypted stream and the encrypted key
+        """
+        symmetric_key, encrypted_key = self.__prepare_keys__()
+        stream_key = self.__derive_stream_key__(symmetric_key)
+        del symmetric_key
+        return self.__encrypt_stream__(stream_key, source_file, parallel=True), base64.b64encode(encrypted_key).decode()
+
+    def decrypt_stream(self, encrypted_key: str, source_file: BinaryIO) -> Iterator[bytes]:
+        """Decrypt an encrypted stream chunk by chunk, every chunk is authenticated before it is returned
+        """
+        stream_key = self.__derive_stream_key__(self.__decrypt_key__(encrypted_key))
+        return self.__decrypt_stream__(stream_key, source_file)
+
+    def get_content_hash(self, source_file: BinaryIO) -> str:
+        source_file.seek(0)
+        content_hash = hashlib.sha256()
+        for chunk in iter(lambda: source_file.read(self.chunk_size), b""):
+            content_hash.update(chunk)
+        source_file.seek(0)
+        return content_hash.hexdigest()
+
     def decrypt(self, encrypted_key, values_to_decrypt: dict[str,bytes]) -> dict[str, bytes]:
         temp_dict = values_to_decrypt.copy()
-        loaded_private_key = self.__load_private_key__()
-        encrypted_key=base64.b64decode(encrypted_key.encode())
-        decrypted_key = loaded_private_key.decrypt(encrypted_key,self.padding_function)
-        del loaded_private_key
-        decryptor = Fernet(decrypted_key)
+        decrypted_key = self.__decrypt_key__(encrypted_key)
+        stream_key = self.__derive_stream_key__(decrypted_key)
+        # Values that were encrypted before the envelope format have a Fernet key
+        decryptor = Fernet(decrypted_key) if len(decrypted_key) != SYMMETRIC_KEY_SIZE else None
         del decrypted_key
         for key, value in temp_dict.items():
             if type(value) is str and value.startswith(self.B64_PREFIX):
                 value=base64.b64decode(temp_dict[key][len(self.B64_PREFIX):].encode())
+            if value.startswith(STREAM_MAGIC):
+                temp_dict[key] = b"".join(self.__decrypt_stream__(stream_key, io.BytesIO(value)))
+                continue
+            if decryptor is None:
+                raise ValueError(f"Unknown encrypted format of {key}")
             temp_dict[key] = zlib.decompress(decryptor.decrypt(value))
         return temp_dict
 
-    def __prepare_encryptor__(self):
-        symmetric_key = Fernet.generate_key()
-        encryptor = Fernet(symmetric_key)
+    def decrypt_many(self, encrypted_items: List[tuple[str, dict[str,bytes]]]) -> List[dict[str, bytes]]:
+        """Decrypt a list of (encrypted_key, values_to_decrypt), for example a page of thumbnails.
+        The keys are unwrapped and the values decrypted in parallel, the results keep the order of the list
+        """
+        return list(self.executor.map(lambda encrypted_item: self.decrypt(encrypted_item[0], encrypted_item[1]), encrypted_items))
+
+    def __decrypt_key__(self, encrypted_key: str) -> bytes:
+        return self.__load_private_key__().decrypt(base64.b64decode(encrypted_key.encode()), self.padding_function)
+
+    def __prepare_keys__(self):
+        symmetric_key = os.urandom(SYMMETRIC_KEY_SIZE)
         encrypted_key = self.public_key.encrypt(symmetric_key,self.padding_function)
-        del symmetric_key
-        return encryptor, encrypted_key
\ No newline at end of file
+        return symmetric_key, encrypted_key
+
+    @staticmethod
+    def __derive_stream_key__(symmetric_key: bytes) -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"shkedia-media-stream").derive(symmetric_key)
+
+    @staticmethod
+    def __stream_nonce__(nonce_prefix: bytes, frame_index: int, is_last: bool) -> bytes:
+        return nonce_prefix + struct.pack(">IB", frame_index, 1 if is_last else 0)
+
+    def get_compression(self, sample: bytes) -> int:
+        """Choose the compression of a value by its first bytes: no compression for media that is already
+        entropy coded or a sample that doesn't compress well, otherwise the configured compression
+        """
+        if self.compression_id == COMPRESSION_NONE or len(sample) == 0:
+            return COMPRESSION_NONE
+        # RIFF....WEBP is WebP, ....ftyp is the ISO media container of HEIC, AVIF, MP4 and MOV
+        if any([sample.startswith(signature) for signature in COMPRESSED_SIGNATURES]) or \
+           (sample[:4] == b"RIFF" and sample[8:12] == b"WEBP") or sample[4:8] == b"ftyp":
+            return COMPRESSION_NONE
+        if len(zlib.compress(sample, 1)) > len(sample)*self.min_compression_ratio:
+            return COMPRESSION_NONE
+        return self.compression_id
+
+    def __get_compressor__(self, compression: int):
+        if compression == COMPRESSION_ZLIB:
+            return zlib.compressobj(self.compression_level)
+        if compression == COMPRESSION_ZSTD:
+            return zstandard.ZstdCompressor(level=self.compression_level).compressobj()
+        return None
+
+    @staticmethod
+    def __get_decompressor__(compression: int):
+        if compression == COMPRESSION_ZLIB:
+            return zlib.decompressobj()
+        if compression == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("The stream is compressed with zstd, but zstandard isn't installed")
+            return zstandard.ZstdDecompressor().decompressobj()
+        if compression == COMPRESSION_NONE:
+            return None
+        raise ValueError("Unsupported encrypted stream compression")
+
+    def __encrypt_stream__(self, stream_key: bytes, source_file: BinaryIO, parallel: bool=False) -> Iterator[bytes]:
+        """With parallel the frames are encrypted on the thread pool, up to parallel_frames ahead of the consumer.
+        It must not be used from a thread pool task, which would wait for tasks queued behind it
+        """
+        cipher = STREAM_CIPHERS[self.cipher_id](stream_key)
+        # The sample is the start of the value, it is encrypted as the first read
+        first_chunk = source_file.read(self.compression_sample_size)
+        compression = self.get_compression(first_chunk)
+        header = struct.pack(STREAM_HEADER_FORMAT, STREAM_MAGIC, STREAM_VERSION, self.cipher_id,
+                             compression, self.chunk_size, os.urandom(7))
+        nonce_prefix = header[-7:]
+        yield header
+        encrypt_frame = lambda frame_index, plain_frame, is_last: cipher.encrypt(self.__stream_nonce__(nonce_prefix, frame_index, is_last), 
+                                                                                 plain_frame, 
+                                                                                 header)
+        plain_frames = self.__split_frames__(source_file, first_chunk, compression)
+        if not parallel:
+            for frame_index, plain_frame, is_last in plain_frames:
+                frame = encrypt_frame(frame_index, plain_frame, is_last)
+                yield struct.pack(STREAM_FRAME_LENGTH_FORMAT, len(frame)) + frame
+            return
+        pending_frames = deque()
+        for frame_index, plain_frame, is_last in plain_frames:
+            pending_frames.append(self.executor.submit(encrypt_frame, frame_index, plain_frame, is_last))
+            if len(pending_frames) >= self.parallel_frames:
+                frame = pending_frames.popleft().result()
+                yield struct.pack(STREAM_FRAME_LENGTH_FORMAT, len(frame)) + frame
+        while pending_frames:
+            frame = pending_frames.popleft().result()
+            yield struct.pack(STREAM_FRAME_LENGTH_FORMAT, len(frame)) + frame
+
+    def __split_frames__(self, source_file: BinaryIO, first_chunk: bytes, compression: int) -> Iterator[tuple]:
+        """Compress the file and split it to (frame index, plain frame, is last frame)
+        """
+        compressor = self.__get_compressor__(compression)
+        buffer = b""
+        frame_index = 0
+        plain_chunk = first_chunk
+        while plain_chunk:
+            buffer += compressor.compress(plain_chunk) if compressor else plain_chunk
+            while len(buffer) >= self.chunk_size:
+                yield frame_index, buffer[:self.chunk_size], False
+                buffer = buffer[self.chunk_size:]
+                frame_index += 1
+            plain_chunk = source_file.read(self.chunk_size)
+        if compressor:
+            buffer += compressor.flush()
+        # The last frame is always written (even empty) and marked, so a truncated stream can't pass as complete
+        while len(buffer) > self.chunk_size:
+            yield frame_index, buffer[:self.chunk_size], False
+            buffer = buffer[self.chunk_size:]
+            frame_index += 1
+        yield frame_index, buffer, True
+
+    def __decrypt_stream__(self, stream_key: bytes, source_file: BinaryIO) -> Iterator[bytes]:
+        header = source_file.read(STREAM_HEADER_SIZE)
+        magic, version, cipher_id, compression, chunk_size, nonce_prefix = struct.unpack(STREAM_HEADER_FORMAT, header)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION or not cipher_id in STREAM_CIPHERS:
+            raise ValueError("Unsupported encrypted stream format")
+        cipher = STREAM_CIPHERS[cipher_id](stream_key)
+        decompressor = self.__get_decompressor__(compression)
+        frame_index = 0
+        frame_length = source_file.read(STREAM_FRAME_LENGTH_SIZE)
+        while frame_length:
+            frame = source_file.read(struct.unpack(STREAM_FRAME_LENGTH_FORMAT, frame_length)[0])
+            frame_length = source_file.read(STREAM_FRAME_LENGTH_SIZE)
+            is_last = not frame_length
+            plain_chunk = cipher.decrypt(self.__stream_nonce__(nonce_prefix, frame_index, is_last), frame, header)
+            frame_index += 1
+            yield decompressor.decompress(plain_chunk) if decompressor else plain_chunk
+        if frame_index == 0:
+            raise ValueError("Encrypted stream is truncated")
+        if decompressor:
+            yield decompressor.flush()
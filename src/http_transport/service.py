@@ -0,0 +1,99 @@
+import logging
+logger = logging.getLogger(__name__)
+import asyncio
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+
+class HttpTransport:
+    """Keep-alive HTTP transport shared by the backend clients
+
+    One requests.Session with a connection pool per host, so the backend calls reuse open connections
+    instead of a TCP handshake per call. Every request gets the connect and read timeouts unless it sets its own
+    """
+
+    def __init__(self,
+                 pool_connections: int=10,
+                 pool_maxsize: int=20,
+                 connect_timeout: float=3.05,
+                 read_timeout: float=30,
+                 max_retries: int=0) -> None:
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # pool_connections is the number of hosts with a cached pool, pool_maxsize the connections kept per host
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, url: str, **kargs) -> requests.Response:
+        kargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kargs)
+
+    def get(self, url: str, **kargs) -> requests.Response:
+        return self.request("GET", url, **kargs)
+
+    def put(self, url: str, **kargs) -> requests.Response:
+        return self.request("PUT", url, **kargs)
+
+    def post(self, url: str, **kargs) -> requests.Response:
+        return self.request("POST", url, **kargs)
+
+    def delete(self, url: str, **kargs) -> requests.Response:
+        return self.request("DELETE", url, **kargs)
+
+    def close(self):
+        self.session.close()
+
+class AsyncHttpTransport:
+    """Keep-alive HTTP transport of the async backend clients
+
+    The asyncio counterpart of HttpTransport - one httpx.AsyncClient, so a request waiting on a backend
+    holds a coroutine instead of a thread. httpx doesn't limit the connections per host, so the pool
+    is bounded by pool_connections*pool_maxsize connections over all the hosts, and requests above it wait for a free connection.
+    The client's connections belong to the event loop that opened them, so the transport is bound to that loop until it is closed
+    """
+
+    def __init__(self,
+                 pool_connections: int=10,
+                 pool_maxsize: int=20,
+                 connect_timeout: float=3.05,
+                 read_timeout: float=30,
+                 max_retries: int=0) -> None:
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_connections*pool_maxsize,
+                                   max_keepalive_connections=pool_connections*pool_maxsize)
+        self.max_retries = max_retries
+        self.client: httpx.AsyncClient | None = None
+        self.client_loop: asyncio.AbstractEventLoop | None = None
+
+    async def request(self, method: str, url: str, **kargs) -> httpx.Response:
+        return await self.__get_client__().request(method, url, **kargs)
+
+    async def get(self, url: str, **kargs) -> httpx.Response:
+        return await self.request("GET", url, **kargs)
+
+    async def put(self, url: str, **kargs) -> httpx.Response:
+        return await self.request("PUT", url, **kargs)
+
+    async def post(self, url: str, **kargs) -> httpx.Response:
+        return await self.request("POST", url, **kargs)
+
+    async def delete(self, url: str, **kargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kargs)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            self.client_loop = None
+
+    def __get_client__(self) -> httpx.AsyncClient:
+        running_loop = asyncio.get_running_loop()
+        if self.client is not None and self.client_loop is not running_loop:
+            # Replacing the client would leak its connections, and they can't be closed from another loop
+            raise RuntimeError("AsyncHttpTransport is bound to another event loop, close it there first")
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout,
+                                            transport=httpx.AsyncHTTPTransport(limits=self.limits, retries=self.max_retries))
+            self.client_loop = running_loop
+        return self.client
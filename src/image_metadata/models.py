@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Any
+
+class GpsLocation(BaseModel):
+    latitude: float
+    longitude: float
+    altitude: float | None = None
+
+class CameraInfo(BaseModel):
+    make: str | None = None
+    model: str | None = None
+    lens_model: str | None = None
+
+class ImageMetadata(BaseModel):
+    width: int
+    height: int
+    image_format: str | None = None
+    orientation: int | None = None
+    taken_at: datetime | None = None
+    location: GpsLocation | None = None
+    camera: CameraInfo | None = None
+    exif: dict[str, Any] | None = None
+
+    @property
+    def is_transposed(self) -> bool:
+        # Orientations 5-8 swap the width and the height
+        return self.orientation in [5, 6, 7, 8]
+
+    @property
+    def display_size(self) -> tuple:
+        # The image size after the rotation by the orientation tag
+        return (self.height, self.width) if self.is_transposed else (self.width, self.height)
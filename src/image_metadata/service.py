@@ -0,0 +1,122 @@
+import logging
+logger = logging.getLogger(__name__)
+from typing import BinaryIO, Any
+from datetime import datetime, timedelta, timezone
+from PIL import Image, ExifTags, TiffImagePlugin
+
+from image_metadata.models import ImageMetadata, GpsLocation, CameraInfo
+
+# The tag tables are resolved once, instead of searching ExifTags.TAGS on every image
+EXIF_TAGS_NAMES: dict[int, str] = dict(ExifTags.TAGS)
+GPS_TAGS_NAMES: dict[int, str] = dict(ExifTags.GPSTAGS)
+# Vendor specific binary blobs, they are big and can't be parsed in a generic way
+EXCLUDED_TAGS = {ExifTags.Base.MakerNote, ExifTags.Base.PrintImageMatching}
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+class ImageMetadataService:
+    """Extract the image metadata from the file header, without decoding the pixels.
+
+    Pillow only reads the header when the image is opened, so the extraction costs a single
+    parse of the EXIF block. The same extraction is used by the thumbnail creation and can be
+    called on its own to enrich the metadata of an image on ingest
+    """
+
+    def extract(self, image_file: BinaryIO) -> ImageMetadata:
+        try:
+            image_file.seek(0)
+            with Image.open(image_file) as image:
+                return ImageMetadataService.extract_from_image(image)
+        except Exception as err:
+            raise Exception(f"Failed to extract the image metadata: {str(err)}")
+
+    @staticmethod
+    def extract_from_image(image: Image) -> ImageMetadata:
+        """Extract the metadata of an opened (not necessarily loaded) image in a single pass over its EXIF
+        """
+        exif = image.getexif()
+        tags = dict(exif.items())
+        tags.update(exif.get_ifd(ExifTags.IFD.Exif))
+        gps_tags = exif.get_ifd(ExifTags.IFD.GPSInfo)
+
+        named_exif = {}
+        for tag, value in tags.items():
+            if tag in EXCLUDED_TAGS or tag in [ExifTags.IFD.Exif, ExifTags.IFD.GPSInfo]:
+                continue
+            named_exif[EXIF_TAGS_NAMES.get(tag, str(tag))] = ImageMetadataService.to_json_value(value)
+        if gps_tags:
+            named_exif["GPSInfo"] = {GPS_TAGS_NAMES.get(tag, str(tag)): ImageMetadataService.to_json_value(value)
+                                     for tag, value in gps_tags.items()}
+
+        orientation = tags.get(ExifTags.Base.Orientation)
+        return ImageMetadata(width=image.size[0],
+                             height=image.size[1],
+                             image_format=image.format,
+                             orientation=orientation if orientation in range(1, 9) else None,
+                             taken_at=ImageMetadataService.get_taken_at(tags),
+                             location=ImageMetadataService.get_location(gps_tags),
+                             camera=ImageMetadataService.get_camera(tags),
+                             exif=named_exif if named_exif else None)
+
+    @staticmethod
+    def get_taken_at(tags: dict) -> datetime | None:
+        for datetime_tag, offset_tag in [(ExifTags.Base.DateTimeOriginal, ExifTags.Base.OffsetTimeOriginal),
+                                         (ExifTags.Base.DateTime, ExifTags.Base.OffsetTime)]:
+            try:
+                taken_at = datetime.strptime(str(tags[datetime_tag]).strip("\x00 "), EXIF_DATETIME_FORMAT)
+            except (KeyError, ValueError):
+                continue
+            try:
+                # The offset format is +HH:MM
+                offset = str(tags[offset_tag]).strip("\x00 ")
+                offset_sign = -1 if offset[0]=="-" else 1
+                offset_hours, offset_minutes = offset[1:].split(":")
+                taken_at = taken_at.replace(tzinfo=timezone(offset_sign*timedelta(hours=int(offset_hours), minutes=int(offset_minutes))))
+            except (KeyError, ValueError, IndexError):
+                pass
+            return taken_at
+        return None
+
+    @staticmethod
+    def get_location(gps_tags: dict) -> GpsLocation | None:
+        try:
+            latitude = ImageMetadataService.to_degrees(gps_tags[ExifTags.GPS.GPSLatitude])
+            longitude = ImageMetadataService.to_degrees(gps_tags[ExifTags.GPS.GPSLongitude])
+        except (KeyError, ValueError, TypeError, ZeroDivisionError):
+            return None
+        if str(gps_tags.get(ExifTags.GPS.GPSLatitudeRef, "N")).strip("\x00 ").upper() == "S":
+            latitude = -latitude
+        if str(gps_tags.get(ExifTags.GPS.GPSLongitudeRef, "E")).strip("\x00 ").upper() == "W":
+            longitude = -longitude
+        if abs(latitude) > 90 or abs(longitude) > 180:
+            return None
+
+        altitude = ImageMetadataService.to_json_value(gps_tags.get(ExifTags.GPS.GPSAltitude))
+        if altitude is not None and gps_tags.get(ExifTags.GPS.GPSAltitudeRef) in [1, b"\x01"]:
+            altitude = -altitude
+        return GpsLocation(latitude=latitude, longitude=longitude, altitude=altitude)
+
+    @staticmethod
+    def get_camera(tags: dict) -> CameraInfo | None:
+        camera_values = [tags.get(tag) for tag in [ExifTags.Base.Make, ExifTags.Base.Model, ExifTags.Base.LensModel]]
+        camera_values = [str(value).strip("\x00 ") or None if value is not None else None for value in camera_values]
+        if not any(camera_values):
+            return None
+        return CameraInfo(make=camera_values[0], model=camera_values[1], lens_model=camera_values[2])
+
+    @staticmethod
+    def to_degrees(dms_value: tuple) -> float:
+        degrees, minutes, seconds = [float(value) for value in dms_value]
+        return degrees + minutes/60 + seconds/3600
+
+    @staticmethod
+    def to_json_value(value) -> Any:
+        # EXIF values as types that can be serialized to JSON
+        if isinstance(value, TiffImagePlugin.IFDRational):
+            return float(value) if value.denominator != 0 else None
+        if isinstance(value, bytes):
+            return value.decode(errors="replace").strip("\x00")
+        if isinstance(value, str):
+            return value.strip("\x00")
+        if isinstance(value, (tuple, list)):
+            return [ImageMetadataService.to_json_value(item) for item in value]
+        return value
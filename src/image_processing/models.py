@@ -0,0 +1,58 @@
+from pydantic import BaseModel
+from typing import List, Any
+
+from image_metadata.models import ImageMetadata
+
+THUMBNAIL_RENDITION_NAME = "thumbnail"
+
+class ThumbnailRendition(BaseModel):
+    name: str
+    max_width: int
+    max_height: int
+    blur_radius: float = 0
+
+    @staticmethod
+    def parse_renditions(renditions: str) -> List["ThumbnailRendition"]:
+        """Parse renditions configuration of the format name:WIDTHxHEIGHT[:BLUR_RADIUS],...
+        For example: grid:256x256,blur:32x32:2
+        Names must be unique and can't be the reserved thumbnail name, so a bad configuration fails at startup
+        """
+        renditions_list = []
+        for rendition in renditions.split(","):
+            if not rendition.strip():
+                continue
+            rendition_parts = rendition.strip().split(":")
+            try:
+                if len(rendition_parts) not in (2, 3) or not rendition_parts[0]:
+                    raise ValueError("expected name:WIDTHxHEIGHT[:BLUR_RADIUS]")
+                max_width, max_height = rendition_parts[1].lower().split("x")
+                new_rendition = ThumbnailRendition(name=rendition_parts[0],
+                                                   max_width=int(max_width),
+                                                   max_height=int(max_height),
+                                                   blur_radius=float(rendition_parts[2]) if len(rendition_parts)>2 else 0)
+                if new_rendition.max_width <= 0 or new_rendition.max_height <= 0 or new_rendition.blur_radius < 0:
+                    raise ValueError("the size must be positive and the blur radius can't be negative")
+            except ValueError as err:
+                raise AttributeError(f"Malformed rendition {rendition.strip()}: {err}")
+            if new_rendition.name == THUMBNAIL_RENDITION_NAME:
+                raise AttributeError(f"The rendition name {THUMBNAIL_RENDITION_NAME} is reserved")
+            if new_rendition.name in [existing_rendition.name for existing_rendition in renditions_list]:
+                raise AttributeError(f"The rendition name {new_rendition.name} is used twice")
+            renditions_list.append(new_rendition)
+        return renditions_list
+
+class RenditionResult(BaseModel):
+    name: str
+    width: int
+    height: int
+    format: str
+    data: bytes
+
+class ImageProcessingResult(BaseModel):
+    image_width: int
+    image_height: int
+    thumbnail: RenditionResult
+    renditions: List[RenditionResult] = []
+    exif: dict[str, Any] | None = None
+    perceptual_hash: str | None = None
+    metadata: ImageMetadata | None = None
@@ -1,83 +1,369 @@
 import io
-import PIL
-from PIL import Image, ExifTags
+import os
+from PIL import Image, ImageFilter, features
 import base64
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
 import logging
 logger = logging.getLogger(__name__)
 
+from image_processing.models import ThumbnailRendition, RenditionResult, ImageProcessingResult, THUMBNAIL_RENDITION_NAME
+from image_metadata.service import ImageMetadataService
+
+class SharedMemoryReader(io.RawIOBase):
+    """Read-only file over a shared memory buffer, so the image can be decoded without copying it
+    """
+
+    def __init__(self, buffer: memoryview) -> None:
+        self.buffer = buffer
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        read_size = min(len(target), len(self.buffer)-self.position)
+        target[:read_size] = self.buffer[self.position:self.position+read_size]
+        self.position += read_size
+        return read_size
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.buffer)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+class ImageTooLargeError(Exception):
+    pass
+
+class MegapixelsBudget:
+    """Limit the decoded pixels of all the images that are processed at the same time
+
+    An image that is bigger than the whole budget waits until nothing else runs, then runs alone
+    """
+
+    def __init__(self, megapixels: float) -> None:
+        self.capacity = int(megapixels*1_000_000)
+        self.pixels_in_use = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, pixels: int):
+        if self.capacity <= 0:
+            yield
+            return
+        pixels = min(pixels, self.capacity)
+        with self.condition:
+            while self.pixels_in_use + pixels > self.capacity:
+                self.condition.wait()
+            self.pixels_in_use += pixels
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.pixels_in_use -= pixels
+                self.condition.notify_all()
+
+def create_thumbnail_from_shared_memory(shared_memory_name: str, image_size: int, service_settings: dict, decode_plan: tuple):
+    # Runs in the process pool workers
+    # The block is owned (and unlinked) by the dispatching process
+    image_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    image_buffer = image_memory.buf[:image_size]
+    try:
+        with SharedMemoryReader(image_buffer) as image_file:
+            return ImageProcessingService(**service_settings).__create_renditions__(image_file, decode_plan)
+    finally:
+        image_buffer.release()
+        image_memory.close()
+
 class ImageProcessingService:
 
     def __init__(self, 
-                 thumbnail_width_size: int=400,
-                 thumbnail_height_size: int=200):
+                 thumbnail_width_size: int=500,
+                 thumbnail_height_size: int=500,
+                 renditions: List[ThumbnailRendition] | None=None,
+                 thumbnail_format: str="JPEG",
+                 thumbnail_quality: int=75,
+                 reducing_gap: float | None=3.0,
+                 process_pool_size: int=0,
+                 max_image_megapixels: float=250,
+                 strip_decode_megapixels: float=50,
+                 strip_megapixels: float=4,
+                 megapixels_budget: float=0,
+                 copy_chunk_size: int=1024*1024):
         self.thumbnail_width_size = thumbnail_width_size
         self.thumbnail_height_size = thumbnail_height_size
+        self.renditions = renditions if renditions else []
+        self.thumbnail_format = ImageProcessingService.get_supported_format(thumbnail_format)
+        self.thumbnail_quality = thumbnail_quality
+        self.reducing_gap = reducing_gap
+        self.max_image_megapixels = max_image_megapixels
+        self.strip_decode_megapixels = strip_decode_megapixels
+        self.strip_megapixels = strip_megapixels
+        self.megapixels_budget = MegapixelsBudget(megapixels_budget)
+        self.copy_chunk_size = copy_chunk_size
+        # The pixels count is checked before the decode. Pillow's (process wide) decompression bomb limit is only raised,
+        # so it doesn't reject images below max_image_megapixels first
+        if Image.MAX_IMAGE_PIXELS is not None:
+            Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS, int(max_image_megapixels*1_000_000))
+        self.process_pool = None
+        if process_pool_size > 0:
+            self.process_pool = ProcessPoolExecutor(max_workers=process_pool_size, 
+                                                    mp_context=multiprocessing.get_context("spawn"))
+
+    def __get_settings__(self) -> dict:
+        return {"thumbnail_width_size": self.thumbnail_width_size,
+                "thumbnail_height_size": self.thumbnail_height_size,
+                "renditions": self.renditions,
+                "thumbnail_format": self.thumbnail_format,
+                "thumbnail_quality": self.thumbnail_quality,
+                "reducing_gap": self.reducing_gap,
+                "max_image_megapixels": self.max_image_megapixels,
+                "strip_decode_megapixels": self.strip_decode_megapixels,
+                "strip_megapixels": self.strip_megapixels}
+
+    def get_image_thumbnail_bytes(self, image_file) -> tuple:
+        processing_result = self.process_image(image_file)
+        return (processing_result.thumbnail.data,
+                (processing_result.image_width, processing_result.image_height),
+                (processing_result.thumbnail.width, processing_result.thumbnail.height),
+                processing_result.exif)
+
+    def process_image(self, image_file) -> ImageProcessingResult:
+        # The header (and EXIF) is read once, the same decode plan is used by the admission control and the decode
+        try:
+            image_file.seek(0)
+            image = Image.open(image_file)
+            decode_plan = self.__get_decode_plan__(image)
+        except ImageTooLargeError:
+            raise
+        except Image.DecompressionBombError as err:
+            raise ImageTooLargeError(str(err))
+        except Exception as err:
+            raise Exception(f"Failed to create thumbnail to image: {str(err)}")
+        with self.megapixels_budget.reserve(self.__get_decode_pixels__(image, decode_plan)):
+            if self.process_pool is None:
+                return self.__create_renditions__(image_file, decode_plan, image=image)
+            return self.__create_renditions_in_pool__(image_file, decode_plan)
+
+    def __get_decode_pixels__(self, image: Image, decode_plan: tuple) -> int:
+        """Admission control - the number of pixels the decode will hold in memory, from the (drafted) image header
+        """
+        _, _, largest_size, strip_layout = decode_plan
+        if strip_layout:
+            decode_pixels = image.size[0]*min(image.size[1], self.__get_strip_rows__(image.size[0]))
+        else:
+            decode_pixels = image.size[0]*image.size[1]
+        return decode_pixels + largest_size[0]*largest_size[1]
 
-    def get_image_thumbnail_bytes(self, image_file) -> bytes:
+    def __create_renditions_in_pool__(self, image_file, decode_plan: tuple) -> ImageProcessingResult:
+        # Pass the image to the worker through shared memory instead of pickling a copy of it
+        image_size = image_file.seek(0, os.SEEK_END)
+        image_file.seek(0)
+        image_memory = shared_memory.SharedMemory(create=True, size=max(image_size, 1))
         try:
-            temp_image = Image.open(image_file)
-            exif_dict = temp_image._getexif()
-            exif_dict = ImageProcessingService.parse_exif(exif_dict)
-            temp_image = ImageProcessingService.rotate_image(temp_image)
-            exif=None
-            if "exif" in temp_image.info:
-                exif = temp_image.info['exif']
-
-            w,h = temp_image.size
-            image_aspect_ratio = h/w
-            image_format = temp_image.format
-            if image_format is None:
-                image_format="JPEG"
-            temp_image = temp_image.resize((self.thumbnail_width_size, int(self.thumbnail_width_size*image_aspect_ratio)))
-            thumbnail_w,thumbnail_h = temp_image.size
-            mem_file = io.BytesIO()
-            if exif:
-                temp_image.save(mem_file, format=image_format, exif=exif)
+            position = 0
+            for chunk in iter(lambda: image_file.read(self.copy_chunk_size), b""):
+                image_memory.buf[position:position+len(chunk)] = chunk
+                position += len(chunk)
+            return self.process_pool.submit(create_thumbnail_from_shared_memory, 
+                                            image_memory.name, 
+                                            image_size, 
+                                            self.__get_settings__(),
+                                            decode_plan).result()
+        finally:
+            image_memory.close()
+            image_memory.unlink()
+
+    def __create_renditions__(self, image_file, decode_plan: tuple, image: Image.Image | None = None) -> ImageProcessingResult:
+        """Create the thumbnail and all the renditions from a single decode of the image, by the plan of __get_decode_plan__.
+        The largest rendition is resized from the decoded image, every other rendition from the previous one
+        """
+        try:
+            image_metadata, renditions_sizes, largest_size, strip_layout = decode_plan
+            temp_image = image
+            if temp_image is None:
+                # The plan was made from another opening of the image (in the process pool), only the draft is repeated
+                image_file.seek(0)
+                temp_image = Image.open(image_file)
+                temp_image.draft(temp_image.mode, largest_size)
+            # The image size is reported after the rotation
+            w,h = image_metadata.display_size
+
+            if strip_layout:
+                temp_image = self.__downscale_by_strips__(temp_image, image_file, strip_layout, largest_size)
             else:
-                temp_image.save(mem_file, format=image_format)
-            image_byte_array = mem_file.getvalue()
-            mem_file.close()
-            # target_file = io.StringIO()
-            # temp_image.save(target_file)
-            # temp_image.close()
-            return image_byte_array, (w,h), (thumbnail_w, thumbnail_h),exif_dict
+                temp_image = temp_image.resize(largest_size, reducing_gap=self.reducing_gap)
+            temp_image = ImageProcessingService.rotate_image(temp_image, image_metadata.orientation)
+
+            # After the loop temp_image is the smallest rendition (before the blur), the perceptual hash is computed from it
+            renditions_results = {}
+            for rendition, rendition_size in renditions_sizes:
+                if temp_image.size != rendition_size:
+                    temp_image = temp_image.resize(rendition_size, reducing_gap=self.reducing_gap)
+                output_image = temp_image
+                if rendition.blur_radius > 0:
+                    output_image = temp_image.filter(ImageFilter.GaussianBlur(rendition.blur_radius))
+                renditions_results[rendition.name] = RenditionResult(name=rendition.name,
+                                                                     width=rendition_size[0],
+                                                                     height=rendition_size[1],
+                                                                     format=self.thumbnail_format,
+                                                                     data=ImageProcessingService.encode_image(output_image, 
+                                                                                                              self.thumbnail_format,
+                                                                                                              self.thumbnail_quality))
+            return ImageProcessingResult(image_width=w,
+                                         image_height=h,
+                                         thumbnail=renditions_results.pop(THUMBNAIL_RENDITION_NAME),
+                                         renditions=[renditions_results[rendition.name] for rendition in self.renditions],
+                                         exif=image_metadata.exif,
+                                         perceptual_hash=ImageProcessingService.get_perceptual_hash(temp_image),
+                                         metadata=image_metadata)
+        except ImageTooLargeError:
+            raise
+        except Image.DecompressionBombError as err:
+            raise ImageTooLargeError(str(err))
         except Exception as err:
             raise Exception(f"Failed to create thumbnail to image: {str(err)}")
 
+    def __get_decode_plan__(self, image: Image) -> tuple:
+        """Check the image size from its header and decide how to decode it, nothing is decoded here.
+        Returns the metadata, the renditions sizes (largest first), the size to decode to (before the rotation)
+        and the raw strips layout when the image should be downscaled strip by strip
+        """
+        image_metadata = ImageMetadataService.extract_from_image(image)
+        if image_metadata.width*image_metadata.height > self.max_image_megapixels*1_000_000:
+            raise ImageTooLargeError(f"The image has {image_metadata.width}x{image_metadata.height} pixels, "
+                                     f"the maximum is {self.max_image_megapixels} megapixels")
+
+        thumbnail_rendition = ThumbnailRendition(name=THUMBNAIL_RENDITION_NAME, max_width=self.thumbnail_width_size, max_height=self.thumbnail_height_size)
+        renditions_sizes = [(rendition, ImageProcessingService.fit_size(image_metadata.display_size, rendition.max_width, rendition.max_height)) 
+                            for rendition in [thumbnail_rendition]+self.renditions]
+        renditions_sizes.sort(key=lambda rendition_size: rendition_size[1][0]*rendition_size[1][1], reverse=True)
+
+        largest_size = renditions_sizes[0][1]
+        if image_metadata.is_transposed:
+            largest_size = (largest_size[1], largest_size[0])
+        # JPEG is decoded with DCT scaling straight to the smallest size above the largest rendition (no-op for other formats),
+        # then the resize reduces the rest by box averaging before resampling
+        image.draft(image.mode, largest_size)
+
+        strip_layout = None
+        if image.size[0]*image.size[1] > self.strip_decode_megapixels*1_000_000:
+            strip_layout = ImageProcessingService.get_raw_strip_layout(image)
+        return image_metadata, renditions_sizes, largest_size, strip_layout
+
+    def __get_strip_rows__(self, image_width: int) -> int:
+        return max(1, int(self.strip_megapixels*1_000_000) // image_width)
+
+    def __downscale_by_strips__(self, image: Image, image_file, strip_layout: tuple, target_size: tuple) -> Image:
+        """Decode the raw rows of the image a strip at a time and downscale every strip into its rows of the target image,
+        so only one strip of the full resolution image is in memory
+        """
+        offset, rawmode, stride, ystep = strip_layout
+        w,h = image.size
+        target_width, target_height = target_size
+        output_mode = image.mode if image.mode in ["L", "RGB", "RGBA"] else "RGB"
+        output_image = Image.new(output_mode, target_size)
+        # Strips are aligned to target rows, so every strip is scaled by exactly the same factor
+        target_rows_per_strip = max(1, self.__get_strip_rows__(w)*target_height // h)
+        for target_top in range(0, target_height, target_rows_per_strip):
+            target_bottom = min(target_height, target_top+target_rows_per_strip)
+            top, bottom = round(target_top*h/target_height), round(target_bottom*h/target_height)
+            # Bottom-up images (ystep -1) store the last row first
+            image_file.seek(offset + (top if ystep==1 else h-bottom)*stride)
+            strip_image = Image.frombuffer(image.mode, (w, bottom-top), image_file.read(stride*(bottom-top)), "raw", rawmode, stride, ystep)
+            if strip_image.mode != output_mode:
+                strip_image = strip_image.convert(output_mode)
+            output_image.paste(strip_image.resize((target_width, target_bottom-target_top), reducing_gap=self.reducing_gap), (0, target_top))
+        return output_image
+
     @staticmethod
-    def parse_exif(exif) -> dict:
-        if exif is None:
+    def get_raw_strip_layout(image: Image) -> tuple | None:
+        """Return (offset, rawmode, stride, ystep) of images that are stored as uncompressed rows (BMP, uncompressed TIFF, PPM),
+        None for compressed images that can only be decoded as a whole
+        """
+        if len(image.tile) != 1 or not image.mode in ["L", "RGB", "RGBA", "CMYK"]:
+            return None
+        codec_name, extents, offset, args = image.tile[0]
+        if codec_name != "raw" or tuple(extents) != (0, 0)+image.size:
             return None
-        tagged_exif = {ExifTags.TAGS[key]:value for key,value in exif.items()}
-        floating_exif = {key:float(value.real) for key,value in tagged_exif.items() if type(value)==PIL.TiffImagePlugin.IFDRational}
-        binary_exif = {key:value.decode() for key,value in tagged_exif.items() if type(value)==bytes}
-        tagged_exif.update(floating_exif)
-        tagged_exif.update(binary_exif)
-
-        return tagged_exif
-        
-        
-    
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode, stride, ystep = (tuple(args)+(0, 1))[:3]
+        if not ystep in [1, -1]:
+            return None
+        if not stride:
+            if rawmode != image.mode:
+                return None
+            stride = len(Image.new(image.mode, (image.size[0], 1)).tobytes())
+        return offset, rawmode, stride, ystep
+
     @staticmethod
-    def rotate_image(image: Image) -> str:
-        try:
-            for orientation in ExifTags.TAGS.keys():
-                if ExifTags.TAGS[orientation]=="Orientation":
-                    break
-
-            exif = image._getexif()
-
-            if exif[orientation] == 3:
-                image=image.rotate(180, expand=True)
-            elif exif[orientation] == 6:
-                image=image.rotate(270, expand=True)
-            elif exif[orientation] == 8:
-                image=image.rotate(90, expand=True)
-
-            return image
-        
-        except (AttributeError, KeyError, IndexError, TypeError):
-            logger.info("Image doesn't have tags :(")
-            return image
-            pass
-        
+    def fit_size(image_size: tuple, max_width: int, max_height: int) -> tuple:
+        # Scale down (never up) to fit inside max_width x max_height, keeping the aspect ratio
+        scale = min(max_width/image_size[0], max_height/image_size[1], 1)
+        return (max(1, round(image_size[0]*scale)), max(1, round(image_size[1]*scale)))
+
+    @staticmethod
+    def get_perceptual_hash(image: Image, hash_size: int=8) -> str:
+        """dHash - compare every pixel of a (hash_size+1)xhash_size grayscale image with its right neighbour.
+        The hash survives scaling, recompression and small edits, so near duplicates have a small Hamming distance
+        """
+        pixels = image.convert("L").resize((hash_size+1, hash_size), Image.Resampling.BOX).tobytes()
+        perceptual_hash = 0
+        for row in range(hash_size):
+            for column in range(hash_size):
+                left_pixel = pixels[row*(hash_size+1)+column]
+                right_pixel = pixels[row*(hash_size+1)+column+1]
+                perceptual_hash = (perceptual_hash << 1) | int(left_pixel > right_pixel)
+        return f"{perceptual_hash:0{hash_size*hash_size//4}x}"
+
+    @staticmethod
+    def get_supported_format(image_format: str) -> str:
+        # Fall back to the next best thumbnail format this Pillow build can encode
+        formats_fallback = ["AVIF", "WEBP", "JPEG"]
+        image_format = image_format.upper()
+        if not image_format in formats_fallback:
+            raise AttributeError(f"Unsupported thumbnail format {image_format}, use one of {formats_fallback}")
+        for fallback_format in formats_fallback[formats_fallback.index(image_format):]:
+            if fallback_format=="JPEG" or features.check(fallback_format.lower()):
+                if fallback_format != image_format:
+                    logger.warning(f"{image_format} isn't supported, create thumbnails as {fallback_format}")
+                return fallback_format
+
+    @staticmethod
+    def encode_image(image: Image, image_format: str, quality: int) -> bytes:
+        # EXIF isn't saved to the thumbnail - it is stored in the media db and the rotation was already applied
+        if not image.mode in ["RGB", "RGBA"] or (image_format=="JPEG" and image.mode=="RGBA"):
+            image = image.convert("RGBA" if image_format!="JPEG" and "A" in image.getbands() else "RGB")
+        mem_file = io.BytesIO()
+        image.save(mem_file, format=image_format, quality=quality)
+        image_byte_array = mem_file.getvalue()
+        mem_file.close()
+        return image_byte_array
+
+    @staticmethod
+    def rotate_image(image: Image, orientation: int | None) -> Image:
+        # Apply the EXIF orientation (including the mirrored ones) to the pixels
+        orientation_transpose = {2: Image.Transpose.FLIP_LEFT_RIGHT,
+                                 3: Image.Transpose.ROTATE_180,
+                                 4: Image.Transpose.FLIP_TOP_BOTTOM,
+                                 5: Image.Transpose.TRANSPOSE,
+                                 6: Image.Transpose.ROTATE_270,
+                                 7: Image.Transpose.TRANSVERSE,
+                                 8: Image.Transpose.ROTATE_90}
+        if orientation in orientation_transpose:
+            image=image.transpose(orientation_transpose[orientation])
+        return image
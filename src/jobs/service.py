@@ -0,0 +1,105 @@
+import logging
+logger = logging.getLogger(__name__)
+import os
+import shutil
+import threading
+from typing import Callable, Any, BinaryIO
+from uuid import uuid4
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pydantic import BaseModel, Field
+
+class UploadJobStatus(str, Enum):
+    PENDING="PENDING"
+    RUNNING="RUNNING"
+    DONE="DONE"
+    FAILED="FAILED"
+
+class UploadJob(BaseModel):
+    job_id: str = Field(default_factory=lambda:str(uuid4()))
+    media_id: str
+    status: UploadJobStatus = UploadJobStatus.PENDING
+    created_on: datetime = Field(default_factory=datetime.now)
+    updated_on: datetime = Field(default_factory=datetime.now)
+    error: str | None = None
+
+class UploadJobService:
+    """Run the upload processing stages in a background worker pool
+
+    The raw upload is persisted to the spool location first, so the request can return
+    as soon as the bytes were received. Finished jobs are kept for jobs_ttl_minutes for status queries.
+    job_timeout_seconds bounds how long a job waits for processing that runs elsewhere (the event loop)
+    """
+
+    def __init__(self,
+                 spool_location: str,
+                 workers_number: int=4,
+                 jobs_ttl_minutes: int=60,
+                 job_timeout_seconds: float=600,
+                 copy_chunk_size: int=1024*1024) -> None:
+        self.spool_location = spool_location
+        self.jobs_ttl = timedelta(minutes=jobs_ttl_minutes)
+        self.job_timeout_seconds = job_timeout_seconds
+        self.copy_chunk_size = copy_chunk_size
+        os.makedirs(self.spool_location, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers_number, thread_name_prefix="upload_job")
+        self.jobs: dict[str, UploadJob] = {}
+        self.lock = threading.Lock()
+
+    def spool_file(self, source_file: BinaryIO) -> str:
+        spool_path = os.path.join(self.spool_location, str(uuid4()))
+        source_file.seek(0)
+        with open(spool_path, "wb") as spool_file:
+            shutil.copyfileobj(source_file, spool_file, self.copy_chunk_size)
+        return spool_path
+
+    def submit(self, media_id: str, spool_path: str, process_function: Callable[[BinaryIO], Any]) -> UploadJob:
+        """Queue the processing of the spooled file. The spooled file is removed when the job ends
+        """
+        new_job = UploadJob(media_id=media_id)
+        with self.lock:
+            self.__remove_expired_jobs__()
+            self.jobs[new_job.job_id] = new_job
+        self.executor.submit(self.__run_job__, new_job, spool_path, process_function)
+        return new_job.model_copy()
+
+    def get(self, job_id: str) -> UploadJob | None:
+        with self.lock:
+            if not job_id in self.jobs:
+                return None
+            return self.jobs[job_id].model_copy()
+
+    def close(self):
+        # Wait for the running jobs, the queued ones are cancelled and stay PENDING
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __run_job__(self, job: UploadJob, spool_path: str, process_function: Callable[[BinaryIO], Any]):
+        self.__set_status__(job, UploadJobStatus.RUNNING)
+        try:
+            with open(spool_path, "rb") as spool_file:
+                process_function(spool_file)
+            self.__set_status__(job, UploadJobStatus.DONE)
+        except Exception as err:
+            error_details = {
+                "job_id": job.job_id,
+                "media_id": job.media_id,
+                "error": str(err)
+            }
+            logger.error(str(error_details))
+            self.__set_status__(job, UploadJobStatus.FAILED, error=str(err))
+        finally:
+            os.remove(spool_path)
+
+    def __set_status__(self, job: UploadJob, job_status: UploadJobStatus, error: str | None=None):
+        with self.lock:
+            job.status = job_status
+            job.error = error
+            job.updated_on = datetime.now()
+
+    def __remove_expired_jobs__(self):
+        expiration_time = datetime.now() - self.jobs_ttl
+        expired_jobs = [job_id for job_id, job in self.jobs.items()
+                        if job.status in [UploadJobStatus.DONE, UploadJobStatus.FAILED] and job.updated_on < expiration_time]
+        for job_id in expired_jobs:
+            self.jobs.pop(job_id)
@@ -1,22 +1,38 @@
 import sys
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 
 import traceback
+from contextlib import asynccontextmanager
 
 
 from config import app_config
 from authentication.service import AuthService
-from db.media_service import MediaDBService
-from db.user_service import UserDBService
-from repo.service import MediaRepoService
+from http_transport.service import HttpTransport, AsyncHttpTransport
+from db.media_service import MediaDBService, AsyncMediaDBService
+from db.user_service import AsyncUserDBService
+from repo.service import AsyncMediaRepoService
 from image_processing.service import ImageProcessingService
+from image_processing.models import ThumbnailRendition
 from encryption.service import EncryptService
+from jobs.service import UploadJobService
+from upload_sessions.service import UploadSessionService
+from near_duplicates.service import NearDuplicateIndexService
 
 from routes.media import UploadServiceHandlerV1
 from routes.users import AuthServiceHandlerV1
     
-app = FastAPI(description="Rest API Interface for the upload service", title="Project Shkedia - Upload Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Let the running jobs end (their processing runs on this loop, so it isn't blocked meanwhile) and drop the queued ones
+    await run_in_threadpool(upload_job_service.close)
+    # Close the kept-alive backend connections
+    await async_http_transport.close()
+    http_transport.close()
+
+app = FastAPI(description="Rest API Interface for the upload service", title="Project Shkedia - Upload Service", lifespan=lifespan)
 
 #TODO: Bind auth service as middleware to all requests
 
@@ -26,22 +42,67 @@ try:
                                db_service=None,
                                default_expire_delta_min=app_config.TOKEN_TIME_PERIOD)
     
-    media_db_service = MediaDBService(host=app_config.MEDIA_DB_HOST, port=app_config.MEDIA_DB_PORT)
+    http_transport = HttpTransport(pool_connections=app_config.HTTP_POOL_CONNECTIONS,
+                                   pool_maxsize=app_config.HTTP_POOL_MAXSIZE,
+                                   connect_timeout=app_config.HTTP_CONNECT_TIMEOUT,
+                                   read_timeout=app_config.HTTP_READ_TIMEOUT)
+
+    async_http_transport = AsyncHttpTransport(pool_connections=app_config.HTTP_POOL_CONNECTIONS,
+                                              pool_maxsize=app_config.HTTP_POOL_MAXSIZE,
+                                              connect_timeout=app_config.HTTP_CONNECT_TIMEOUT,
+                                              read_timeout=app_config.HTTP_READ_TIMEOUT)
+
+    # The sync client is used by the services that run in worker threads (near duplicates index)
+    media_db_service = MediaDBService(host=app_config.MEDIA_DB_HOST,
+                                      port=app_config.MEDIA_DB_PORT,
+                                      transport=http_transport,
+                                      parallel_pages=app_config.MEDIA_DB_PARALLEL_PAGES)
+
+    async_media_db_service = AsyncMediaDBService(host=app_config.MEDIA_DB_HOST,
+                                                 port=app_config.MEDIA_DB_PORT,
+                                                 transport=async_http_transport,
+                                                 parallel_pages=app_config.MEDIA_DB_PARALLEL_PAGES)
     
-    user_db_service = UserDBService(host=app_config.USER_DB_HOST, port=app_config.USER_DB_PORT)
+    user_db_service = AsyncUserDBService(host=app_config.USER_DB_HOST, port=app_config.USER_DB_PORT, transport=async_http_transport)
 
-    media_repo_service = MediaRepoService(host=app_config.MEDIA_REPO_HOST, port=app_config.MEDIA_REPO_PORT)
+    media_repo_service = AsyncMediaRepoService(host=app_config.MEDIA_REPO_HOST, port=app_config.MEDIA_REPO_PORT, transport=async_http_transport)
     
-    image_proccessing_service = ImageProcessingService()
+    image_proccessing_service = ImageProcessingService(thumbnail_width_size=app_config.THUMBNAIL_MAX_WIDTH,
+                                                       thumbnail_height_size=app_config.THUMBNAIL_MAX_HEIGHT,
+                                                       renditions=ThumbnailRendition.parse_renditions(app_config.THUMBNAIL_RENDITIONS),
+                                                       thumbnail_format=app_config.THUMBNAIL_FORMAT,
+                                                       thumbnail_quality=app_config.THUMBNAIL_QUALITY,
+                                                       process_pool_size=app_config.THUMBNAIL_PROCESS_POOL_SIZE,
+                                                       max_image_megapixels=app_config.THUMBNAIL_MAX_IMAGE_MEGAPIXELS,
+                                                       strip_decode_megapixels=app_config.THUMBNAIL_STRIP_DECODE_MEGAPIXELS,
+                                                       megapixels_budget=app_config.THUMBNAIL_MEGAPIXELS_BUDGET)
     
     encryption_service = EncryptService(public_key_location=app_config.PUBLIC_KEY_LOCATION,
-                                        private_key_location=app_config.PRIVATE_KEY_LOCATION)
+                                        private_key_location=app_config.PRIVATE_KEY_LOCATION,
+                                        chunk_size=app_config.ENCRYPTION_CHUNK_SIZE,
+                                        cipher=app_config.ENCRYPTION_CIPHER,
+                                        compression=app_config.ENCRYPTION_COMPRESSION,
+                                        compression_level=app_config.ENCRYPTION_COMPRESSION_LEVEL,
+                                        workers_number=app_config.ENCRYPTION_WORKERS)
     
+    upload_job_service = UploadJobService(spool_location=app_config.UPLOAD_SPOOL_LOCATION,
+                                          workers_number=app_config.UPLOAD_JOBS_WORKERS,
+                                          job_timeout_seconds=app_config.UPLOAD_JOB_TIMEOUT)
+
+    upload_session_service = UploadSessionService(spool_location=app_config.UPLOAD_SPOOL_LOCATION,
+                                                  session_ttl_hours=app_config.UPLOAD_SESSION_TTL)
+
     media_service = UploadServiceHandlerV1(app_logging_service=None,
                                            encryption_service=encryption_service,
-                                           media_db_service=media_db_service,
+                                           media_db_service=async_media_db_service,
                                            image_proccessing_service=image_proccessing_service,
-                                           media_repo_service=media_repo_service) #, auth_service=auth_service)
+                                           media_repo_service=media_repo_service,
+                                           upload_job_service=upload_job_service,
+                                           upload_session_service=upload_session_service,
+                                           near_duplicates_index=NearDuplicateIndexService(media_db_service=media_db_service,
+                                                                                           index_ttl_seconds=app_config.NEAR_DUPLICATES_INDEX_TTL),
+                                           batch_workers_number=app_config.UPLOAD_BATCH_WORKERS,
+                                           cpu_workers_number=app_config.UPLOAD_CPU_WORKERS) #, auth_service=auth_service)
 
     users_service = AuthServiceHandlerV1(user_db_service=user_db_service)    
 except Exception as err:
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import Union, TypeVar, Type, List, Any
+from pydantic import BaseModel, Field, create_model, field_validator
+from typing import Union, TypeVar, Type, List, Any, Generic
+from functools import lru_cache
 from uuid import uuid4
 from datetime import datetime
 
@@ -28,10 +29,26 @@ class MediaRequest(BaseModel):
     media_thumbnail: str | None = None
     media_thumbnail_width: int | None = None
     media_thumbnail_height: int | None = None
+    media_thumbnail_format: str | None = None
+    media_renditions: str | None = None # JSON of rendition name -> {width, height, format, data}
     created_on: datetime
     device_id: str
     device_media_uri: str
     exif: str | None = None
+    # Typed copies of the EXIF values, so the db can filter and index them
+    taken_at: datetime | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    camera_make: str | None = None
+    camera_model: str | None = None
+    orientation: int | None = None
+
+    @field_validator("taken_at")
+    @classmethod
+    def to_wall_time(cls, taken_at: datetime | None) -> datetime | None:
+        # taken_at is the local wall time of the capture (TIMESTAMP without a time zone), the EXIF offset is dropped
+        # so values with and without an offset are stored the same way
+        return taken_at.replace(tzinfo=None) if taken_at else taken_at
 
 class MediaResponse(MediaRequest):
     media_id: str = Field(default_factory=lambda:str(uuid4()))
@@ -41,14 +58,25 @@ class MediaResponse(MediaRequest):
 
 TMediaModel = TypeVar("TMediaModel", bound=MediaRequest)
 
+# The columns that were added to medias after it was first created, with their types in __sql_create_table__
+MEDIAS_ADDED_COLUMNS = {"media_thumbnail_format": "VARCHAR ( 10 )",
+                        "media_renditions": "TEXT",
+                        "taken_at": "TIMESTAMP",
+                        "latitude": "DOUBLE PRECISION",
+                        "longitude": "DOUBLE PRECISION",
+                        "camera_make": "VARCHAR ( 100 )",
+                        "camera_model": "VARCHAR ( 100 )",
+                        "orientation": "smallint",
+                        "content_hash": "VARCHAR ( 64 )",
+                        "perceptual_hash": "VARCHAR ( 16 )"}
+
 class MediaDB(MediaResponse):
     storage_service_name: str | None = None
     storage_bucket_name: str | None = None
     storage_media_uri: str | None = None
     media_key: str | None = None
-
-    def __init__(self, **karg):
-        MediaResponse.__init__(self,**karg)
+    content_hash: str | None = None # SHA-256 of the original media bytes
+    perceptual_hash: str | None = None # 64 bit dHash of the image as hex, similar images have close hashes
 
     @staticmethod
     def __sql_create_table__(environment: str):
@@ -62,10 +90,18 @@ class MediaDB(MediaResponse):
             media_thumbnail TEXT,
             media_thumbnail_width smallint,
             media_thumbnail_height smallint,
+            media_thumbnail_format VARCHAR ( 10 ),
+            media_renditions TEXT,
             created_on TIMESTAMP NOT NULL,
             device_id VARCHAR ( 50 ) NOT NULL REFERENCES devices_"""+environment+"""(device_id),
             device_media_uri VARCHAR ( 250 ) NOT NULL,
             exif TEXT,
+            taken_at TIMESTAMP,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION,
+            camera_make VARCHAR ( 100 ),
+            camera_model VARCHAR ( 100 ),
+            orientation smallint,
             media_id VARCHAR ( 50 ) PRIMARY KEY,
             upload_status VARCHAR ( 50 ) NOT NULL,
             media_status_on_device VARCHAR ( 50 ) NOT NULL,
@@ -73,9 +109,28 @@ class MediaDB(MediaResponse):
             storage_service_name VARCHAR ( 50 ),
             storage_bucket_name VARCHAR ( 50 ),
             storage_media_uri VARCHAR ( 250 ),
-            media_key VARCHAR ( 2048 )
+            media_key VARCHAR ( 2048 ),
+            content_hash VARCHAR ( 64 ),
+            perceptual_hash VARCHAR ( 16 )
         )"""
         return sql_template
+
+    @staticmethod
+    def __sql_migrate_table__(environment: str) -> List[str]:
+        """Add the columns that are newer than the table, CREATE TABLE IF NOT EXISTS doesn't change an existing table.
+        Idempotent - run after __sql_create_table__ and before __sql_create_indexes__
+        """
+        return ["ALTER TABLE medias_"+environment+" ADD COLUMN IF NOT EXISTS "+column_name+" "+column_type
+                for column_name, column_type in MEDIAS_ADDED_COLUMNS.items()]
+
+    @staticmethod
+    def __sql_create_indexes__(environment: str) -> List[str]:
+        indexes = {"content_hash": "owner_id, content_hash",
+                   "taken_at": "owner_id, taken_at",
+                   "location": "owner_id, latitude, longitude",
+                   "camera": "owner_id, camera_make, camera_model"}
+        return ["CREATE INDEX IF NOT EXISTS medias_"+environment+"_"+index_name+"_idx ON medias_"+environment+" ("+index_columns+")"
+                for index_name, index_columns in indexes.items()]
     
     def __sql_insert__(self, environment: str):
         columns = []
@@ -90,17 +145,94 @@ class MediaDB(MediaResponse):
         return sql_template, values
 
     @staticmethod
-    def __sql_select_item__(field_names, field_values, environment: str):
-        sql_template = f"SELECT * FROM medias_{environment} WHERE"
+    def __sql_insert_batch__(medias: List["MediaDB"], environment: str):
+        """Create a single multi-row insert for all the medias
+
+        Rows that already exist are skipped and the statement returns the media_id of the inserted rows only.
+        The statement is all-or-nothing - any other failing row rejects the whole batch, so the caller retries
+        the rows one by one to tell which of them failed
+        """
+        if len(medias)==0:
+            raise AttributeError("Nothing to insert")
+        media_dicts = [media.model_dump() for media in medias]
+        # Only the columns that none of the medias set are left out, falsy values (0, "") are inserted as they are
+        columns = [field_name for field_name in MediaDB.model_fields 
+                   if any([media_dict[field_name] is not None for media_dict in media_dicts])]
+        rows = []
+        values = []
+        for media_dict in media_dicts:
+            rows.append("("+",".join(["%s"]*len(columns))+")")
+            values += [media_dict[column] for column in columns]
+
+        sql_template = "INSERT INTO medias_"+environment+"(" + ",".join(columns) + ") VALUES "+",".join(rows)
+        sql_template += " ON CONFLICT DO NOTHING RETURNING media_id"
+        values = (tuple)(values)
+        return sql_template, values
+
+    @staticmethod
+    def __sql_select_item__(field_names, field_values, environment: str,
+                            order_by: List[str] | None = None,
+                            descending: bool = False,
+                            keyset_values: list | None = None,
+                            limit: int | None = None,
+                            offset: int | None = None,
+                            range_conditions: dict[str, list] | None = None,
+                            fields: List[str] | None = None):
+        if fields:
+            MediaDB.__validate_column_names__(fields)
+        sql_template = f"SELECT {','.join(fields) if fields else '*'} FROM medias_{environment}"
         search_string = []
         sql_values=[]
         for field_index, field_name in enumerate(field_names):
             field_search = f"{field_name} IN (" + ",".join(["%s"]*len(field_values[field_index])) + ")"
             search_string.append(field_search)
             sql_values+=field_values[field_index]
-        sql_template += " "+" AND ".join(search_string)
+        if range_conditions:
+            # Inclusive [min, max] range, a None bound is open
+            MediaDB.__validate_column_names__(list(range_conditions.keys()))
+            for field_name, (min_value, max_value) in range_conditions.items():
+                if min_value is not None:
+                    search_string.append(f"{field_name} >= %s")
+                    sql_values.append(min_value)
+                if max_value is not None:
+                    search_string.append(f"{field_name} <= %s")
+                    sql_values.append(max_value)
+        if order_by:
+            MediaDB.__validate_column_names__(order_by)
+        if keyset_values:
+            # Keyset paging - continue right after the last row of the previous page
+            if not order_by or len(keyset_values)!=len(order_by):
+                raise AttributeError("keyset_values must match the order_by fields")
+            comparison = "<" if descending else ">"
+            search_string.append("(" + ",".join(order_by) + f") {comparison} (" + ",".join(["%s"]*len(keyset_values)) + ")")
+            sql_values+=keyset_values
+        if len(search_string)>0:
+            sql_template += " WHERE "+" AND ".join(search_string)
+        if order_by:
+            direction = " DESC" if descending else " ASC"
+            sql_template += " ORDER BY " + ",".join([column+direction for column in order_by])
+        if limit:
+            sql_template += " LIMIT %s"
+            sql_values.append(int(limit))
+        if offset:
+            sql_template += " OFFSET %s"
+            sql_values.append(int(offset))
         return sql_template, (tuple)(sql_values)
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_projection_model(fields: tuple) -> Type[BaseModel]:
+        """A model of only the selected fields, for the search results that were projected to them
+        """
+        MediaDB.__validate_column_names__(list(fields))
+        return create_model("MediaProjection", **{field_name: (MediaDB.model_fields[field_name].annotation, None) for field_name in fields})
+
+    @staticmethod
+    def __validate_column_names__(column_names: List[str]):
+        for column_name in column_names:
+            if not column_name in MediaDB.model_fields:
+                raise AttributeError(f"{column_name} is not a media field")
+
     def __sql_update_item__(self,updated_model, environment: str):
         update_dictionary = self.__get_updated_values__(updated_model=updated_model)
         if len(update_dictionary)==0:
@@ -129,8 +261,30 @@ class MediaDB(MediaResponse):
                 input_dict[field_name]=source_dict[field_name]
         return target_model(**input_dict)
     
+class InsertStatus(str, Enum):
+    INSERTED="INSERTED"
+    CONFLICT="CONFLICT"
+    FAILED="FAILED"
+
+class BatchInsertItemResult(BaseModel):
+    index: int # The position of the media in the batch request
+    media_id: str | None = None
+    status: InsertStatus
+    detail: str | None = None
+
+class BatchInsertResult(BaseModel):
+    results: List[BatchInsertItemResult]
+
 class SearchResult(BaseModel):
     total_results_number: int
     page_number: int = 0
     page_size: int | None = None
-    results: List[MediaDB]
\ No newline at end of file
+    results: List[MediaDB]
+
+TProjection = TypeVar("TProjection", bound=BaseModel)
+
+class ProjectedSearchResult(BaseModel, Generic[TProjection]):
+    total_results_number: int
+    page_number: int = 0
+    page_size: int | None = None
+    results: List[TProjection] # Projections of MediaDB, see MediaDB.get_projection_model
@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+class NearDuplicate(BaseModel):
+    media_id: str
+    distance: int # Hamming distance between the perceptual hashes
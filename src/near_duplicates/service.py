@@ -0,0 +1,115 @@
+import logging
+logger = logging.getLogger(__name__)
+import threading
+from typing import List, Tuple
+from datetime import datetime, timedelta
+
+from authentication.models import Token
+from db.media_service import MediaDBService
+from near_duplicates.models import NearDuplicate
+
+def hamming_distance(first_hash: int, second_hash: int) -> int:
+    return bin(first_hash ^ second_hash).count("1")
+
+class BKTree:
+    """Burkhard-Keller tree over the Hamming distance of perceptual hashes
+
+    Every child is kept under its distance from the parent, so by the triangle inequality a search
+    for distance <= k only descends into children with distance in [d-k, d+k]
+    """
+
+    def __init__(self) -> None:
+        self.root = None # (hash, media_ids, children)
+        self.size = 0
+
+    def add(self, perceptual_hash: int, media_id: str):
+        self.size += 1
+        if self.root is None:
+            self.root = (perceptual_hash, [media_id], {})
+            return
+        node = self.root
+        while True:
+            node_hash, node_media_ids, node_children = node
+            distance = hamming_distance(perceptual_hash, node_hash)
+            if distance == 0:
+                if not media_id in node_media_ids:
+                    node_media_ids.append(media_id)
+                return
+            if not distance in node_children:
+                node_children[distance] = (perceptual_hash, [media_id], {})
+                return
+            node = node_children[distance]
+
+    def search(self, perceptual_hash: int, max_distance: int) -> List[Tuple[str, int]]:
+        results = []
+        nodes_to_visit = [self.root] if self.root else []
+        while nodes_to_visit:
+            node_hash, node_media_ids, node_children = nodes_to_visit.pop()
+            distance = hamming_distance(perceptual_hash, node_hash)
+            if distance <= max_distance:
+                results += [(media_id, distance) for media_id in node_media_ids]
+            for child_distance, child in node_children.items():
+                if distance-max_distance <= child_distance <= distance+max_distance:
+                    nodes_to_visit.append(child)
+        return results
+
+class NearDuplicateIndexService:
+    """Keep a BK-tree of the perceptual hashes of every owner's uploaded images
+
+    The tree is built from the media db on the first query of the owner and updated with the images
+    uploaded by this instance. It's rebuilt after index_ttl_seconds to pick up changes of other instances.
+    The trees are searched and updated under the lock, and the index of an owner is built by one query at a time
+    """
+
+    def __init__(self,
+                 media_db_service: MediaDBService,
+                 index_ttl_seconds: int=600,
+                 page_size: int=1000) -> None:
+        self.media_db_service = media_db_service
+        self.index_ttl = timedelta(seconds=index_ttl_seconds)
+        self.page_size = page_size
+        self.indexes: dict[str, Tuple[BKTree, datetime]] = {}
+        self.build_locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def add(self, owner_id: str, media_id: str, perceptual_hash: str):
+        # Only an index that was already built is updated, otherwise the image is loaded with the rest on the first query
+        with self.lock:
+            if owner_id in self.indexes:
+                self.indexes[owner_id][0].add(int(perceptual_hash, 16), media_id)
+
+    def find(self, token: Token, owner_id: str, media_id: str, perceptual_hash: str, max_distance: int) -> List[NearDuplicate]:
+        index = self.__get_index__(token, owner_id)
+        with self.lock:
+            search_results = index.search(int(perceptual_hash, 16), max_distance)
+        near_duplicates = [NearDuplicate(media_id=near_media_id, distance=distance)
+                           for near_media_id, distance in search_results
+                           if near_media_id != media_id]
+        near_duplicates.sort(key=lambda near_duplicate: near_duplicate.distance)
+        return near_duplicates
+
+    def __get_index__(self, token: Token, owner_id: str) -> BKTree:
+        with self.lock:
+            build_lock = self.build_locks.setdefault(owner_id, threading.Lock())
+        # Concurrent first queries of the owner wait for a single build
+        with build_lock:
+            with self.lock:
+                if owner_id in self.indexes and datetime.now() - self.indexes[owner_id][1] < self.index_ttl:
+                    return self.indexes[owner_id][0]
+            index = self.__build_index__(token, owner_id)
+            with self.lock:
+                self.indexes[owner_id] = (index, datetime.now())
+            return index
+
+    def __build_index__(self, token: Token, owner_id: str) -> BKTree:
+        index = BKTree()
+        for media in self.media_db_service.search_media_all(token=token,
+                                                            page_size=self.page_size,
+                                                            owner_id=owner_id,
+                                                            upload_status="UPLOADED",
+                                                            order_by=["created_on", "media_id"],
+                                                            fields=["media_id", "perceptual_hash"]):
+            if media.perceptual_hash:
+                index.add(int(media.perceptual_hash, 16), media.media_id)
+        logger.info(f"Built near duplicates index of {owner_id} with {index.size} images")
+        return index
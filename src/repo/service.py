@@ -1,12 +1,14 @@
 import logging
 logger = logging.getLogger(__name__)
-from typing import List
+from typing import List, Iterable
+from uuid import uuid4
 from fastapi import Request
-import requests
+from fastapi.concurrency import iterate_in_threadpool
 import json
 from pydantic import BaseModel
 
 from authentication.models import Token
+from http_transport.service import AsyncHttpTransport
 from models.media import MediaRequest, MediaDB, SearchResult
 
 class PutImageResponse(BaseModel):
@@ -14,62 +16,45 @@ class PutImageResponse(BaseModel):
     bucket_name: str
     storage_service_name: str
 
-class MediaRepoService:
+class AsyncMediaRepoService:
+    """The media repo client of the async routes
+    """
 
     def __init__(self,
                  host: str,
                  port: str | int,
-                 connection_timeout: int=10
+                 connection_timeout: int=10,
+                 transport: AsyncHttpTransport | None=None
                  ) -> None:
         self.service_url = f"http://{host}:{str(port)}"
         self.connection_timeout = connection_timeout
-       
-    def is_ready(self):
-        raise NotImplementedError("Is it necessary?")
+        self.transport = transport if transport else AsyncHttpTransport(connect_timeout=connection_timeout)
 
-    def put_media(self, token: Token, media_id: str, media_bytes: bytes) -> PutImageResponse:
-
-        files={"media": (media_id, media_bytes)}
+    async def put_media(self, token: Token, media_id: str, media_bytes: bytes | Iterable[bytes]) -> PutImageResponse:
 
         put_media = self.service_url+"/media/"
-        insert_response = requests.put(put_media,files=files, headers=token.get_token_as_header())
+        if type(media_bytes) is bytes:
+            files={"media": (media_id, media_bytes)}
+            insert_response = await self.transport.put(put_media,files=files, headers=token.get_token_as_header())
+        else:
+            # The chunks are produced (read and encrypted) in a worker thread, so the event loop only sends them
+            boundary = uuid4().hex
+            headers = token.get_token_as_header()
+            headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+            multipart_stream = AsyncMediaRepoService.__multipart_stream__(boundary, "media", media_id, media_bytes)
+            insert_response = await self.transport.put(put_media,
+                                                       content=iterate_in_threadpool(multipart_stream),
+                                                       headers=headers)
 
         if insert_response.status_code == 200:
             return PutImageResponse(**insert_response.json())
         raise Exception(insert_response.json()["detail"])
-    
-    # def get(self, token: Token, media_id) -> MediaDB:
-    #     insert_url = self.service_url+"/v1/media/"+media_id
-    #     insert_response = requests.get(insert_url, headers=token.get_token_as_header())
-
-    #     if insert_response.status_code == 200:
-    #         return MediaDB(**insert_response.json())
-    #     raise Exception(insert_response.json()["details"])
-
-    # def search_media(self, token: Token, **kargs) -> SearchResult:
-    #     insert_url = self.service_url+"/v1/media/search"
-    #     search_response = requests.get(insert_url,params=kargs, headers=token.get_token_as_header())
-
-    #     if search_response.status_code == 200:
-    #         return SearchResult(**search_response.json())
-    #     raise Exception(search_response.json()["detail"])
-    
-    # def delete(self, token: Token, media_id) -> MediaDB:
-    #     insert_url = self.service_url+"/v1/media/"+media_id
-    #     insert_response = requests.delete(insert_url, headers=token.get_token_as_header())
-
-    #     if insert_response.status_code == 200:
-    #         return MediaDB(**insert_response.json())
-    #     raise Exception(insert_response.json()["detail"])
-    
-    # def update(self, token: Token, media: MediaDB):
-    #     insert_url = self.service_url+"/v1/media/"+media.media_id
-    #     content = media.model_dump_json()
-    #     insert_response = requests.post(insert_url, json=json.loads(content), headers=token.get_token_as_header())
-
-    #     if insert_response.status_code == 200:
-    #         return MediaDB(**insert_response.json())
-    #     raise Exception(insert_response.json()["detail"])
-
 
-        
+    @staticmethod
+    def __multipart_stream__(boundary: str, field_name: str, file_name: str, media_chunks: Iterable[bytes]):
+        yield (f"--{boundary}\r\n"
+               f"Content-Disposition: form-data; name=\"{field_name}\"; filename=\"{file_name}\"\r\n"
+               "Content-Type: application/octet-stream\r\n\r\n").encode()
+        for media_chunk in media_chunks:
+            yield media_chunk
+        yield f"\r\n--{boundary}--\r\n".encode()
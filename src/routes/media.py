@@ -1,16 +1,27 @@
 import json
 import logging
 logger = logging.getLogger(__name__)
-from fastapi import APIRouter, HTTPException, status, Request, Depends, UploadFile, Body
-from typing import List, Annotated
+import asyncio
+import functools
+from fastapi import APIRouter, HTTPException, status, Request, Depends, UploadFile, Body, Response, Form
+from fastapi.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Annotated, BinaryIO, Callable, Any
 from pydantic import BaseModel, Field
 from datetime import datetime
 import base64
 
-from repo.service import MediaRepoService
-from db.media_service import MediaDBService, MediaDB, MediaRequest, SearchResult, Token
-from image_processing.service import ImageProcessingService
+from repo.service import AsyncMediaRepoService
+from db.media_service import AsyncMediaDBService, MediaDB, MediaRequest, SearchResult, Token
+from models.media import InsertStatus
+from routes.search_utils import encode_search_cursor, decode_search_cursor
+from image_processing.service import ImageProcessingService, ImageTooLargeError
+from image_metadata.models import ImageMetadata
 from encryption.service import EncryptService
+from jobs.service import UploadJobService, UploadJob
+from upload_sessions.service import UploadSessionService, UploadSession, UploadSessionOffsetError, UploadSessionFinalizingError
+from near_duplicates.service import NearDuplicateIndexService
+from near_duplicates.models import NearDuplicate
 
 def get_token(request:Request):
     try:
@@ -47,16 +58,53 @@ class GetUploadListResponse(BaseModel):
     images_names: List[str]=[] # List of the field image_device_name values
     images_ids: List[str]=[] # List of the db's id field values
     images_uri: List[str]=[] # List of the field image_device_uri values
+    cursor: str | None = None # Opaque position of the last image, send it back to get the next page
 
     @staticmethod
-    def parse_images_list(images_list: List[MediaDB]):
+    def parse_images_list(images_list: List[Any], page_size: int | None = None):
+        # The images are projections with media_id, media_name, device_media_uri and created_on
         new_response: GetUploadListResponse = GetUploadListResponse()
         for media_dict in images_list:
             new_response.images_ids.append(media_dict.media_id)
             new_response.images_names.append(media_dict.media_name)
             new_response.images_uri.append(media_dict.device_media_uri)
+        if page_size and len(images_list)==page_size:
+            last_media = images_list[-1]
+            new_response.cursor = encode_search_cursor([last_media.created_on.isoformat(), last_media.media_id])
         return new_response
     
+class CreateUploadSessionRequest(BaseModel):
+    user_name: str
+    device_id: str
+    image_id: str
+    total_size: int
+    overwrite: bool = False
+
+class LinkImageRequest(BaseModel):
+    user_name: str
+    device_id: str
+    image_id: str
+    content_hash: str # SHA-256 hex digest of the image bytes
+
+class LinkImageResponse(BaseModel):
+    linked: bool # When False the image should be uploaded
+    source_media_id: str | None = None
+
+class PutImageJobResponse(BaseModel):
+    job_id: str
+
+class PutImageBatchItemResult(BaseModel):
+    image_id: str
+    status_code: int
+    detail: str | None = None
+
+class PutImagesBatchResponse(BaseModel):
+    results: List[PutImageBatchItemResult]
+
+class GetNearDuplicatesResponse(BaseModel):
+    image_id: str
+    near_duplicates: List[NearDuplicate] # Closest first
+
 class GetImagesToDeleteResponse(BaseModel):
     uri_list: List[str]    
 
@@ -64,11 +112,17 @@ class UploadServiceHandlerV1:
     def __init__(self, 
                 app_logging_service,
                 #  auth_service: AuthService,
-                media_db_service: MediaDBService,
+                media_db_service: AsyncMediaDBService,
                 encryption_service: EncryptService,
-                media_repo_service: MediaRepoService,
+                media_repo_service: AsyncMediaRepoService,
                 image_proccessing_service: ImageProcessingService,
+                upload_job_service: UploadJobService | None = None,
+                upload_session_service: UploadSessionService | None = None,
+                near_duplicates_index: NearDuplicateIndexService | None = None,
                 max_response_length: int = 200,
+                metadata_batch_size: int = 500,
+                batch_workers_number: int = 4,
+                cpu_workers_number: int = 4,
                  ):
         self.media_db_service = media_db_service
         self.logging_service = app_logging_service
@@ -76,6 +130,13 @@ class UploadServiceHandlerV1:
         self.encrytion_service = encryption_service
         self.media_repo_service = media_repo_service
         self.max_response_length = max_response_length
+        self.metadata_batch_size = metadata_batch_size
+        self.upload_job_service = upload_job_service
+        self.upload_session_service = upload_session_service
+        self.near_duplicates_index = near_duplicates_index
+        self.batch_workers_number = batch_workers_number
+        # The hashing, thumbnail and encryption stages run here, so they don't block the event loop
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers_number, thread_name_prefix="upload_cpu")
         # self.auth_service = auth_service
         # if not self.media_db_service.is_ready():
         #     raise Exception("Can't initializes without db_service")
@@ -101,6 +162,37 @@ class UploadServiceHandlerV1:
         router.add_api_route(path="", 
                              endpoint=self.put_image,
                              methods=["put"])
+        router.add_api_route(path="/link", 
+                             endpoint=self.post_link_image,
+                             methods=["post"],
+                             response_model=LinkImageResponse)
+        router.add_api_route(path="/batch", 
+                             endpoint=self.put_images_batch,
+                             methods=["put"],
+                             response_model=PutImagesBatchResponse)
+        router.add_api_route(path="/sessions", 
+                             endpoint=self.post_upload_session,
+                             methods=["post"],
+                             response_model=UploadSession)
+        router.add_api_route(path="/sessions/{session_id}", 
+                             endpoint=self.get_upload_session,
+                             methods=["get"],
+                             response_model=UploadSession)
+        router.add_api_route(path="/sessions/{session_id}", 
+                             endpoint=self.patch_upload_session,
+                             methods=["patch"],
+                             response_model=UploadSession)
+        router.add_api_route(path="/sessions/{session_id}/finalize", 
+                             endpoint=self.post_finalize_upload_session,
+                             methods=["post"])
+        router.add_api_route(path="/jobs/{job_id}", 
+                             endpoint=self.get_upload_job,
+                             methods=["get"],
+                             response_model=UploadJob)
+        router.add_api_route(path="/near_duplicates", 
+                             endpoint=self.get_near_duplicates,
+                             methods=["get"],
+                             response_model=GetNearDuplicatesResponse)
         router.add_api_route(path="/delete/next", 
                              endpoint=self.get_images_to_delete,
                              methods=["get"],
@@ -110,19 +202,13 @@ class UploadServiceHandlerV1:
                              methods=["delete"])
         return router
 
-    def get_latest_image_date(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_id: str) -> GetLatestImageResponse:
+    async def get_latest_image_date(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_id: str) -> GetLatestImageResponse:
         try:
-            page_size = 1000
-            search_result = self.media_db_service.search_media(token=token,device_id=device_id, page_size=page_size)
-            if search_result.total_results_number==0:
+            # A single ordered and limited query, the media db also validates the token
+            latest_media = await self.media_db_service.get_latest_media(token=token, device_id=device_id)
+            if latest_media is None:
                 return GetLatestImageResponse.get_latest_image_repsonse(create_on=datetime(year=1970, month=1, day=1))
-            media_list_for_device = search_result.results
-            while len(search_result.results)>0:
-                search_result = self.media_db_service.search_media(token=token,device_id=device_id, page_size=page_size, page_number=search_result.page_number+1)
-                media_list_for_device += search_result.results
-            media_list_for_device.sort(key=lambda x: x.created_on, reverse=True)
-
-            return GetLatestImageResponse.get_latest_image_repsonse(create_on=media_list_for_device[0].created_on)
+            return GetLatestImageResponse.get_latest_image_repsonse(create_on=latest_media.created_on)
 
         except Exception as err:
             if type(err) == HTTPException:
@@ -132,47 +218,65 @@ class UploadServiceHandlerV1:
             logger.error(err)
             raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
 
-    def get_images_to_upload(self, token: Annotated[Token, Depends(get_token)], user_name:str, device_id: str, image_index: int=0)-> GetUploadListResponse:
+    async def get_images_to_upload(self, token: Annotated[Token, Depends(get_token)], user_name:str, device_id: str, image_index: int=0, cursor: str | None=None)-> GetUploadListResponse:
         try:
-            # Get all images for device_id and their MEDIA_STOAGE_STATUS=PENDING
-            page_size=1000
-            search_result = self.media_db_service.search_media(token=token, device_id=device_id, upload_status="PENDING", page_size=page_size)
-            media_list_for_device = search_result.results
-            if len(media_list_for_device)==0:
-                return GetUploadListResponse(images_names=[], images_ids=[], images_uri=[])
-            while len(search_result.results)>0 and len(media_list_for_device)<self.max_response_length:
-                search_result = self.media_db_service.search_media(token=token,device_id=device_id, upload_status="PENDING", page_size=page_size, page_number=search_result.page_number+1)
-                media_list_for_device += search_result.results
-            #TODO: Sort all the images by created date
-            media_list_for_device.sort(key=lambda x: x.created_on, reverse=True)
-            #TODO: Calculate the list according to the image_index value
-            
-            #TODO: Parse the list to GetUploadListResponse
-            return GetUploadListResponse.parse_images_list(media_list_for_device[image_index:image_index+self.max_response_length])
-            pass
+            # Get the next page of images for device_id with MEDIA_STOAGE_STATUS=PENDING, newest first
+            search_params = {"order_by": ["created_on", "media_id"],
+                             "order_direction": "desc",
+                             "page_size": self.max_response_length}
+            if cursor:
+                try:
+                    search_params["after"] = decode_search_cursor(cursor)
+                except ValueError as err:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+            elif image_index>0:
+                # Compatibility with clients that still page with image_index
+                search_params["offset"] = image_index
+            search_result = await self.media_db_service.search_media(token=token, device_id=device_id, upload_status="PENDING",
+                                                                     fields=["media_id", "media_name", "device_media_uri", "created_on"], **search_params)
+            return GetUploadListResponse.parse_images_list(search_result.results, page_size=self.max_response_length)
         except Exception as err:
+            if type(err) == HTTPException:
+                raise err
             logger.error(err)
             if "not found" in str(err):
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
             raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
         
-    def put_images_metadata(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_id: str, images_list: List[ImageRequest]) -> PutImagesMetadataResponse:
+    async def put_images_metadata(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_id: str, images_list: List[ImageRequest]) -> PutImagesMetadataResponse:
         try:
             new_response = PutImagesMetadataResponse(number_of_images_updated=0)
             error_list = []
 
-            for image in images_list:
-                media_request = MediaRequest(media_name=image.name,
-                                             media_type="IMAGE",
-                                             media_size_bytes=image.size,
-                                             created_on=datetime.fromtimestamp(image.date),
-                                             device_id=device_id,
-                                             device_media_uri=image.uri)
+            media_requests = [MediaRequest(media_name=image.name,
+                                           media_type="IMAGE",
+                                           media_size_bytes=image.size,
+                                           created_on=datetime.fromtimestamp(image.date),
+                                           device_id=device_id,
+                                           device_media_uri=image.uri,
+                                           camera_make=image.camera_maker if image.camera_maker else None,
+                                           camera_model=image.camera_model if image.camera_model else None) for image in images_list]
+
+            for batch_start in range(0, len(media_requests), self.metadata_batch_size):
+                media_batch = media_requests[batch_start:batch_start+self.metadata_batch_size]
                 try:
-                    self.media_db_service.insert_media(token=token,media=media_request)
-                    new_response.number_of_images_updated+=1
+                    batch_result = await self.media_db_service.insert_media_batch(token=token, media_list=media_batch)
                 except Exception as err:
-                    error_list.append(f"Failed to insert image {media_request.media_name} metadata from {device_id}:  {str(err)}")           
+                    # A batch is all-or-nothing, the rows are inserted one by one so a bad row doesn't fail the others
+                    logger.warning(f"Failed to insert a metadata batch from {device_id}, inserting its images one by one: {str(err)}")
+                    for media_request in media_batch:
+                        try:
+                            await self.media_db_service.insert_media(token=token, media=media_request)
+                            new_response.number_of_images_updated+=1
+                        except Exception as err:
+                            error_list.append(f"Failed to insert image {media_request.media_name} metadata from {device_id}:  {str(err)}")
+                    continue
+                for item_result in batch_result.results:
+                    media_request = media_batch[item_result.index]
+                    if item_result.status == InsertStatus.INSERTED:
+                        new_response.number_of_images_updated+=1
+                        continue
+                    error_list.append(f"Failed to insert image {media_request.media_name} metadata from {device_id}:  {item_result.detail if item_result.detail else item_result.status.value}")
             if len(error_list) > 0:
                 logger.error(error_list)
             if len(error_list)==len(images_list):
@@ -186,45 +290,34 @@ class UploadServiceHandlerV1:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
             raise HTTPException(status_code=500,detail="Server Internal Error")
 
-    def put_image(self, image: UploadFile, 
+    async def put_image(self, image: UploadFile, 
                   token: Annotated[Token, Depends(get_token)], 
                   user_name: Annotated[str, Body(...)],
                   device_id: Annotated[str, Body(...)], 
                   image_name: Annotated[str, Body(...)],
                   image_id: Annotated[str, Body(...)],
                   uri: Annotated[str, Body(...)],
-                  overwrite: Annotated[bool, Body(...)]=False) -> dict:
+                  response: Response,
+                  overwrite: Annotated[bool, Body(...)]=False,
+                  background: Annotated[bool, Body(...)]=False) -> dict:
         try:
             # Get the image metadata
             # body = await request.form()
-            search_result = self.media_db_service.search_media(token=token, media_id=image_id)
+            search_result = await self.media_db_service.search_media(token=token, media_id=image_id)
             search_result = search_result.results[0]
             if not overwrite and search_result.storage_media_uri:
                 raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Media with that name already exists")
-            values_to_encrypt={}
-            values_to_encrypt["image"]=image.file.read()
-            # Create thumbnail of the image
-            values_to_encrypt["thumbnail"], image_size, thumbnail_size, exif=self.image_proccessing_service.get_image_thumbnail_bytes(image.file)
-            # Encrypt all the data and get encrypted key
-            values_to_encrypt, encrypted_key = self.encrytion_service.encrypt(values_to_encrypt=values_to_encrypt)
-            # Upload the encrypted image to the repo
-            media_storage_info = self.media_repo_service.put_media(token=token, 
-                                                                   media_id=search_result.media_id,
-                                                                   media_bytes=values_to_encrypt["image"])
-
-            # Update the image metadata in the db (Added key, thumbnail, storage status and url)
-            search_result.media_key=encrypted_key
-            search_result.media_thumbnail=values_to_encrypt["thumbnail"]
-            search_result.storage_bucket_name=media_storage_info.bucket_name
-            search_result.storage_media_uri=media_storage_info.media_uri # Make sure repo returns it
-            search_result.storage_service_name=media_storage_info.storage_service_name # Make sure repo returns it
-            search_result.media_width=image_size[0]
-            search_result.media_height=image_size[1]
-            search_result.media_thumbnail_width=thumbnail_size[0]
-            search_result.media_thumbnail_height=thumbnail_size[1]
-            search_result.upload_status="UPLOADED"
-            search_result.exif=json.dumps(exif)
-            self.media_db_service.update(token=token, media=search_result)
+            if background:
+                if self.upload_job_service is None:
+                    raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Background uploads are not enabled")
+                # Persist the raw upload and let the job workers process it
+                spool_path = await run_in_threadpool(self.upload_job_service.spool_file, image.file)
+                upload_job = self.upload_job_service.submit(media_id=search_result.media_id,
+                                                            spool_path=spool_path,
+                                                            process_function=self.__get_job_process_function__(token=token, media=search_result))
+                response.status_code = status.HTTP_202_ACCEPTED
+                return PutImageJobResponse(job_id=upload_job.job_id).model_dump()
+            await self.__process_image__(token=token, media=search_result, image_file=image.file)
             return {}
         except Exception as err:
             if type(err) == HTTPException:
@@ -234,26 +327,322 @@ class UploadServiceHandlerV1:
                 "error": str(err)
             }
             logger.error(str(error_details))
+            if type(err) == ImageTooLargeError:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(err))
+            raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
+
+    async def put_images_batch(self, images: List[UploadFile],
+                         token: Annotated[Token, Depends(get_token)],
+                         user_name: Annotated[str, Form()],
+                         device_id: Annotated[str, Form()],
+                         images_ids: Annotated[List[str], Form()],
+                         overwrite: Annotated[bool, Form()]=False) -> PutImagesBatchResponse:
+        try:
+            if len(images)!=len(images_ids):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each image should have an image_id")
+            if len(set(images_ids))!=len(images_ids):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The same image_id was sent more than once")
+            # Get all the images metadata with one search
+            search_result = await self.media_db_service.search_media(token=token, media_id=images_ids, page_size=len(images_ids))
+            medias = {media.media_id: media for media in search_result.results}
+
+            batch_results = {}
+            process_tasks = {}
+            batch_semaphore = asyncio.Semaphore(self.batch_workers_number)
+            for image, image_id in zip(images, images_ids):
+                if not image_id in medias:
+                    batch_results[image_id] = PutImageBatchItemResult(image_id=image_id, status_code=status.HTTP_404_NOT_FOUND, detail="Media was not found")
+                    continue
+                if not overwrite and medias[image_id].storage_media_uri:
+                    batch_results[image_id] = PutImageBatchItemResult(image_id=image_id, status_code=status.HTTP_409_CONFLICT, detail="Media with that name already exists")
+                    continue
+                process_tasks[image_id] = self.__process_batch_image__(batch_semaphore, token, medias[image_id], image.file)
+            # Process the images of the batch concurrently
+            process_results = await asyncio.gather(*process_tasks.values(), return_exceptions=True)
+            for image_id, process_result in zip(process_tasks.keys(), process_results):
+                if not isinstance(process_result, Exception):
+                    batch_results[image_id] = PutImageBatchItemResult(image_id=image_id, status_code=status.HTTP_200_OK)
+                else:
+                    err = process_result
+                    error_details = {
+                        "media_id": image_id,
+                        "error": str(err)
+                    }
+                    logger.error(str(error_details))
+                    error_status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE if type(err) == ImageTooLargeError else status.HTTP_500_INTERNAL_SERVER_ERROR
+                    batch_results[image_id] = PutImageBatchItemResult(image_id=image_id, status_code=error_status_code, detail=str(err))
+            return PutImagesBatchResponse(results=[batch_results[image_id] for image_id in images_ids])
+        except Exception as err:
+            if type(err) == HTTPException:
+                raise err
+            logger.error(str(err))
+            raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
+
+    async def __process_batch_image__(self, batch_semaphore: asyncio.Semaphore, token: Token, media: MediaDB, image_file: BinaryIO) -> MediaDB:
+        async with batch_semaphore:
+            return await self.__process_image__(token=token, media=media, image_file=image_file)
+
+    async def post_link_image(self, token: Annotated[Token, Depends(get_token)], link_request: LinkImageRequest) -> LinkImageResponse:
+        """Check if identical media was already uploaded before sending the image bytes. If it was, link the image to it
+        """
+        try:
+            search_result = await self.media_db_service.search_media(token=token, media_id=link_request.image_id)
+            if len(search_result.results)==0:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media was not found")
+            media = search_result.results[0]
+            source_media = await self.media_db_service.get_media_by_hash(token=token, content_hash=link_request.content_hash.lower(), owner_id=media.owner_id)
+            if source_media is None:
+                return LinkImageResponse(linked=False)
+            if source_media.media_id != media.media_id:
+                await self.__link_media__(token=token, media=media, source_media=source_media)
+            return LinkImageResponse(linked=True, source_media_id=source_media.media_id)
+        except Exception as err:
+            if type(err) == HTTPException:
+                raise err
+            logger.error(str(err))
+            raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
+
+    async def post_upload_session(self, token: Annotated[Token, Depends(get_token)], session_request: CreateUploadSessionRequest) -> UploadSession:
+        try:
+            self.__check_upload_sessions_enabled__()
+            search_result = await self.media_db_service.search_media(token=token, media_id=session_request.image_id)
+            if len(search_result.results)==0:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media was not found")
+            if not session_request.overwrite and search_result.results[0].storage_media_uri:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Media with that name already exists")
+            return await run_in_threadpool(self.upload_session_service.create,
+                                           media_id=session_request.image_id,
+                                           device_id=session_request.device_id,
+                                           total_size=session_request.total_size,
+                                           overwrite=session_request.overwrite)
+        except Exception as err:
+            if type(err) == HTTPException:
+                raise err
+            logger.error(str(err))
+            if type(err) == AttributeError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+            raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
+
+    async def get_upload_session(self, token: Annotated[Token, Depends(get_token)], session_id: str) -> UploadSession:
+        self.__check_upload_sessions_enabled__()
+        try:
+            upload_session = await run_in_threadpool(self.upload_session_service.get, session_id)
+        except FileNotFoundError:
+            upload_session = None
+        if upload_session is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session was not found")
+        return upload_session
+
+    async def patch_upload_session(self, token: Annotated[Token, Depends(get_token)], session_id: str, offset: int, chunk: UploadFile) -> UploadSession:
+        try:
+            self.__check_upload_sessions_enabled__()
+            return await run_in_threadpool(self.upload_session_service.append_chunk, session_id=session_id, offset=offset, chunk_file=chunk.file)
+        except UploadSessionOffsetError as err:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(err), headers={"Upload-Offset": str(err.received_size)})
+        except UploadSessionFinalizingError as err:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(err))
+        except FileNotFoundError as err:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session was not found")
+        except Exception as err:
+            if type(err) == HTTPException:
+                raise err
+            logger.error(str(err))
+            raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
+
+    async def post_finalize_upload_session(self, token: Annotated[Token, Depends(get_token)], session_id: str, response: Response, background: bool=False) -> dict:
+        self.__check_upload_sessions_enabled__()
+        try:
+            # Until the session is removed or the finalize fails, it rejects chunks and other finalize calls
+            upload_session = await run_in_threadpool(self.upload_session_service.begin_finalize, session_id)
+        except UploadSessionOffsetError as err:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(err), headers={"Upload-Offset": str(err.received_size)})
+        except UploadSessionFinalizingError as err:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(err))
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session was not found")
+        try:
+            search_result = await self.media_db_service.search_media(token=token, media_id=upload_session.media_id)
+            media = search_result.results[0]
+            data_path = self.upload_session_service.get_data_path(session_id)
+            if background:
+                if self.upload_job_service is None:
+                    raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Background uploads are not enabled")
+                # The job takes ownership of the session's data file
+                upload_job = self.upload_job_service.submit(media_id=media.media_id,
+                                                            spool_path=data_path,
+                                                            process_function=self.__get_job_process_function__(token=token, media=media))
+                await run_in_threadpool(self.upload_session_service.remove, session_id, keep_data=True)
+                response.status_code = status.HTTP_202_ACCEPTED
+                return PutImageJobResponse(job_id=upload_job.job_id).model_dump()
+            with open(data_path, "rb") as image_file:
+                await self.__process_image__(token=token, media=media, image_file=image_file)
+            await run_in_threadpool(self.upload_session_service.remove, session_id)
+            return {}
+        except Exception as err:
+            if type(err) == HTTPException:
+                await run_in_threadpool(self.upload_session_service.cancel_finalize, session_id)
+                raise err
+            error_details = {
+                "media_id": upload_session.media_id,
+                "session_id": session_id,
+                "error": str(err)
+            }
+            logger.error(str(error_details))
+            if type(err) == ImageTooLargeError:
+                # The session can't succeed, so it isn't kept
+                await run_in_threadpool(self.upload_session_service.remove, session_id)
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(err))
+            # On failure the session is kept, so the client can finalize again without uploading
+            await run_in_threadpool(self.upload_session_service.cancel_finalize, session_id)
+            raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
+
+    def __check_upload_sessions_enabled__(self):
+        if self.upload_session_service is None:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Resumable uploads are not enabled")
+
+    async def get_upload_job(self, token: Annotated[Token, Depends(get_token)], job_id: str) -> UploadJob:
+        if self.upload_job_service is None:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Background uploads are not enabled")
+        upload_job = self.upload_job_service.get(job_id)
+        if upload_job is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job was not found")
+        return upload_job
+
+    async def __process_image__(self, token: Token, media: MediaDB, image_file: BinaryIO) -> MediaDB:
+        """Thumbnail, encrypt and upload the image file to the repo, then update its metadata in the db
+
+        The image file is never read into memory as a whole - the thumbnail is created from the file,
+        and the image is encrypted in chunks while it is streamed to the repo
+        """
+        # Identical media that was already uploaded is linked instead of being processed and stored again
+        content_hash = await self.__run_cpu_stage__(self.encrytion_service.get_content_hash, image_file)
+        source_media = await self.media_db_service.get_media_by_hash(token=token, content_hash=content_hash, owner_id=media.owner_id)
+        if source_media and source_media.media_id != media.media_id:
+            return await self.__link_media__(token=token, media=media, source_media=source_media)
+        # Create the thumbnail and the renditions of the image
+        image_file.seek(0)
+        processing_result = await self.__run_cpu_stage__(self.image_proccessing_service.process_image, image_file)
+        # Encrypt all the data and get encrypted key
+        image_file.seek(0)
+        values_to_encrypt={"image": image_file, "thumbnail": processing_result.thumbnail.data}
+        for rendition in processing_result.renditions:
+            values_to_encrypt[f"rendition_{rendition.name}"] = rendition.data
+        values_to_encrypt, encrypted_key = await self.__run_cpu_stage__(self.encrytion_service.encrypt, values_to_encrypt=values_to_encrypt)
+        # Upload the encrypted image to the repo
+        media_storage_info = await self.media_repo_service.put_media(token=token, 
+                                                               media_id=media.media_id,
+                                                               media_bytes=values_to_encrypt["image"])
+
+        # Update the image metadata in the db (Added key, thumbnail, storage status and url)
+        media.media_key=encrypted_key
+        media.media_thumbnail=values_to_encrypt["thumbnail"]
+        media.storage_bucket_name=media_storage_info.bucket_name
+        media.storage_media_uri=media_storage_info.media_uri # Make sure repo returns it
+        media.storage_service_name=media_storage_info.storage_service_name # Make sure repo returns it
+        media.media_width=processing_result.image_width
+        media.media_height=processing_result.image_height
+        media.media_thumbnail_width=processing_result.thumbnail.width
+        media.media_thumbnail_height=processing_result.thumbnail.height
+        media.media_thumbnail_format=processing_result.thumbnail.format
+        media.media_renditions=json.dumps({rendition.name: {"width": rendition.width,
+                                                            "height": rendition.height,
+                                                            "format": rendition.format,
+                                                            "data": values_to_encrypt[f"rendition_{rendition.name}"]}
+                                           for rendition in processing_result.renditions})
+        media.upload_status="UPLOADED"
+        media.exif=json.dumps(processing_result.exif)
+        media.content_hash=content_hash
+        media.perceptual_hash=processing_result.perceptual_hash
+        UploadServiceHandlerV1.__set_metadata_columns__(media, processing_result.metadata)
+        updated_media = await self.media_db_service.update(token=token, media=media)
+        if self.near_duplicates_index and media.perceptual_hash:
+            self.near_duplicates_index.add(owner_id=media.owner_id, media_id=media.media_id, perceptual_hash=media.perceptual_hash)
+        return updated_media
+
+    async def __run_cpu_stage__(self, stage_function: Callable, *args, **kargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, functools.partial(stage_function, *args, **kargs))
+
+    def __get_job_process_function__(self, token: Token, media: MediaDB) -> Callable[[BinaryIO], MediaDB]:
+        # The job workers are threads, they wait for the processing that runs on the event loop of the request.
+        # The wait is bounded, so a job doesn't hang (and block the shutdown) if the loop stops
+        event_loop = asyncio.get_running_loop()
+        job_timeout_seconds = self.upload_job_service.job_timeout_seconds
+        def process_function(image_file: BinaryIO) -> MediaDB:
+            processing = asyncio.run_coroutine_threadsafe(self.__process_image__(token=token, media=media, image_file=image_file), event_loop)
+            try:
+                return processing.result(timeout=job_timeout_seconds)
+            except TimeoutError:
+                processing.cancel()
+                raise TimeoutError(f"The processing didn't end in {job_timeout_seconds} seconds")
+        return process_function
+
+    @staticmethod
+    def __set_metadata_columns__(media: MediaDB, image_metadata: ImageMetadata | None):
+        # The EXIF values win over the ones the device sent with the images metadata
+        if image_metadata is None:
+            return
+        media.orientation=image_metadata.orientation
+        if image_metadata.taken_at:
+            # The column is local wall time, see MediaRequest.to_wall_time (assignments aren't validated)
+            media.taken_at=MediaRequest.to_wall_time(image_metadata.taken_at)
+        if image_metadata.location:
+            media.latitude=image_metadata.location.latitude
+            media.longitude=image_metadata.location.longitude
+        if image_metadata.camera:
+            media.camera_make=image_metadata.camera.make if image_metadata.camera.make else media.camera_make
+            media.camera_model=image_metadata.camera.model if image_metadata.camera.model else media.camera_model
+
+    async def __link_media__(self, token: Token, media: MediaDB, source_media: MediaDB) -> MediaDB:
+        """Point the media to the stored (and encrypted) content of identical source media
+        """
+        for field_name in ["media_key", "media_thumbnail", "media_renditions", "storage_bucket_name", "storage_media_uri", "storage_service_name",
+                           "media_width", "media_height", "media_thumbnail_width", "media_thumbnail_height", "media_thumbnail_format", "exif", "content_hash", "perceptual_hash",
+                           "taken_at", "latitude", "longitude", "camera_make", "camera_model", "orientation"]:
+            setattr(media, field_name, getattr(source_media, field_name))
+        media.upload_status="UPLOADED"
+        return await self.media_db_service.update(token=token, media=media)
+
+    async def get_near_duplicates(self, token: Annotated[Token, Depends(get_token)], user_name: str, image_id: str, max_distance: int=10) -> GetNearDuplicatesResponse:
+        """Find the uploaded images of the owner whose perceptual hash is within max_distance bits of the image
+        """
+        try:
+            if self.near_duplicates_index is None:
+                raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Near duplicates search is not enabled")
+            if max_distance < 0 or max_distance > 32:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="max_distance must be between 0 and 32")
+            search_result = await self.media_db_service.search_media(token=token, media_id=image_id)
+            if len(search_result.results)==0:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media was not found")
+            media = search_result.results[0]
+            if not media.perceptual_hash:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The image wasn't uploaded yet")
+            near_duplicates = await run_in_threadpool(self.near_duplicates_index.find,
+                                                      token=token,
+                                                      owner_id=media.owner_id,
+                                                      media_id=media.media_id,
+                                                      perceptual_hash=media.perceptual_hash,
+                                                      max_distance=max_distance)
+            return GetNearDuplicatesResponse(image_id=image_id, near_duplicates=near_duplicates)
+        except Exception as err:
+            if type(err) == HTTPException:
+                raise err
+            logger.error(str(err))
             raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
 
-    def get_images_to_delete(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_id: str) -> GetImagesToDeleteResponse:
+    async def get_images_to_delete(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_id: str) -> GetImagesToDeleteResponse:
         try:
-            # Search for media with device_id=device_id and UPLOAD_STATUS=UPLOADED
-            search_result = self.media_db_service.search_media(token=token, device_id=device_id, upload_status="UPLOADED")
-            media_list_for_device = search_result.results
-            while len(media_list_for_device) < search_result.total_results_number:
-                search_result = self.media_db_service.search_media(token=token,device_id=device_id, upload_status="UPLOADED", page_number=search_result.page_number+1)
-            # Sort the list from old to new
-            media_list_for_device.sort(key=lambda x: x.created_on, reverse=False)
-            # Get the 50 first (old)
-            return GetImagesToDeleteResponse(uri_list=[media.device_media_uri for media in media_list_for_device[0:50]])
+            # Search for the 50 oldest media with device_id=device_id and UPLOAD_STATUS=UPLOADED
+            search_result = await self.media_db_service.search_media(token=token, device_id=device_id, upload_status="UPLOADED",
+                                                                     order_by=["created_on", "media_id"], order_direction="asc", page_size=50,
+                                                                     fields=["device_media_uri"])
+            return GetImagesToDeleteResponse(uri_list=[media.device_media_uri for media in search_result.results])
         except Exception as err:
             logger.error(err)
             if "not found" in str(err):
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
             raise HTTPException(status_code=500, detail="Sorry, Something is wrong. Can't get an answer")
         
-    def post_deleted_images(self, user_name: str, device_id: str, images_list: List[str]):
+    async def post_deleted_images(self, user_name: str, device_id: str, images_list: List[str]):
         try:
             raise HTTPException(status_code=status.HTTP_425_TOO_EARLY)
             #TODO: Search for media with device_id=device_id and UPLOAD_STATUS=UPLOADED
@@ -1,9 +1,17 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import json
+import base64
 from pydantic import BaseModel
 from typing import List, Any
 
+# Query params that control the search (paging and ordering) and must not be used as field filters
+SEARCH_CONTROL_PARAMS = ["page_size", "page_number", "order_by", "order_direction", "after", "offset", "fields"]
+# Range filters are sent as <field>__min=<value> and <field>__max=<value>
+RANGE_MIN_SUFFIX = "__min"
+RANGE_MAX_SUFFIX = "__max"
+
 class SearchResult(BaseModel):
     total_results_number: int
     page_number: int = 0
@@ -25,9 +33,46 @@ def extract_search_params_from_request(query_params: list, black_list_values: li
     query_params_dict = {}
     for search_condition in query_params:
         current_key=search_condition[0]
-        if search_condition[0] in black_list_values:
+        if search_condition[0] in black_list_values or is_range_param(current_key):
             continue
         if not current_key in query_params_dict:
             query_params_dict[current_key] = []
         query_params_dict[current_key].append(search_condition[1])
-    return query_params_dict
\ No newline at end of file
+    return query_params_dict
+
+def extract_search_control_from_request(query_params: list) -> dict:
+    """Extract the ordering, keyset paging and projection params as arguments for the models __sql_select_item__
+    """
+    search_control = {"order_by": [], "descending": False, "keyset_values": [], "range_conditions": {}, "fields": []}
+    for search_condition in query_params:
+        if is_range_param(search_condition[0]):
+            is_min = search_condition[0].endswith(RANGE_MIN_SUFFIX)
+            field_name = search_condition[0][:-len(RANGE_MIN_SUFFIX if is_min else RANGE_MAX_SUFFIX)]
+            range_bounds = search_control["range_conditions"].setdefault(field_name, [None, None])
+            range_bounds[0 if is_min else 1] = search_condition[1]
+        if search_condition[0] == "order_by":
+            search_control["order_by"].append(search_condition[1])
+        if search_condition[0] == "order_direction":
+            search_control["descending"] = search_condition[1].lower() == "desc"
+        if search_condition[0] == "after":
+            search_control["keyset_values"].append(search_condition[1])
+        if search_condition[0] == "offset":
+            search_control["offset"] = int(search_condition[1])
+        if search_condition[0] == "fields":
+            search_control["fields"].append(search_condition[1])
+    return search_control
+
+def is_range_param(param_name: str) -> bool:
+    return param_name.endswith(RANGE_MIN_SUFFIX) or param_name.endswith(RANGE_MAX_SUFFIX)
+
+def encode_search_cursor(keyset_values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(keyset_values).encode()).decode()
+
+def decode_search_cursor(cursor: str) -> list:
+    try:
+        keyset_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as err:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not type(keyset_values) is list:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return keyset_values
\ No newline at end of file
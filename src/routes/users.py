@@ -6,7 +6,7 @@ from pydantic import BaseModel
 from datetime import datetime
 import base64
 
-from db.user_service import UserDBService, UserRequest, DeviceRequest
+from db.user_service import AsyncUserDBService, UserRequest, DeviceRequest
 from db.media_service import Token #TODO: Move token to different place
 
 def get_token(request:Request):
@@ -37,7 +37,7 @@ class DeviceListResponse(BaseModel):
 class AuthServiceHandlerV1:
     def __init__(self, 
                 # app_logging_service,
-                user_db_service: UserDBService,
+                user_db_service: AsyncUserDBService,
                  ):
         self.user_db_service = user_db_service
         self.router = self.__initialize_routes__()
@@ -69,37 +69,37 @@ class AuthServiceHandlerV1:
                              response_model=DeviceListResponse)
         return router
     
-    def put_user(self, user: UserRequest) -> PutUserResponse:
+    async def put_user(self, user: UserRequest) -> PutUserResponse:
         try:
-            user_response = self.user_db_service.insert_user(user)
+            user_response = await self.user_db_service.insert_user(user)
             return PutUserResponse(user_name=user_response.user_name, user_id=user_response.user_id)
         except Exception as err:
             raise HTTPException(status_code=500, detail=str(err))
 
-    def post_login(self, user:UserRequest) -> UserLoginResponse:
+    async def post_login(self, user:UserRequest) -> UserLoginResponse:
         try:
-            return self.user_db_service.login_user(user)
+            return await self.user_db_service.login_user(user)
         except Exception as err:
             if "Permission Denied" in str(err):
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Permission Denied")
             raise HTTPException(status_code=500, detail=str(err))
 
-    def get_device_register(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_name: str) -> DeviceResponse:
+    async def get_device_register(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_name: str) -> DeviceResponse:
         try:
             # Check if device exists
-            list_of_devices = self.user_db_service.search_device(token=token, search_field="device_name", search_value=device_name)
+            list_of_devices = await self.user_db_service.search_device(token=token, search_field="device_name", search_value=device_name)
             if len(list_of_devices)>0:
                 raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Device Name Taken")
             # Create Device
-            new_device = self.user_db_service.insert_device(token=token, device_request=DeviceRequest(device_name=device_name, owner_name=user_name))
+            new_device = await self.user_db_service.insert_device(token=token, device_request=DeviceRequest(device_name=device_name, owner_name=user_name))
             return DeviceResponse(user_name=user_name, device_id=new_device.device_id)
         except Exception as err:
             raise HTTPException(status_code=500, detail=str(err))
 
-    def get_reattach_device(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_name: str) -> DeviceResponse:
+    async def get_reattach_device(self, token: Annotated[Token, Depends(get_token)], user_name: str, device_name: str) -> DeviceResponse:
         try:
             # Get Device details by device name
-            list_of_devices = self.user_db_service.search_device(token=token, search_field="device_name", search_value=device_name)
+            list_of_devices = await self.user_db_service.search_device(token=token, search_field="device_name", search_value=device_name)
             # Find device id from device name
             if len(list_of_devices)==0:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device was not found")
@@ -107,12 +107,12 @@ class AuthServiceHandlerV1:
         except Exception as err:
             raise HTTPException(status_code=500, detail=str(err))
 
-    def get_devices_list(self, token: Annotated[Token, Depends(get_token)], user_name: str) -> DeviceListResponse:
+    async def get_devices_list(self, token: Annotated[Token, Depends(get_token)], user_name: str) -> DeviceListResponse:
         try:
             # Get User Details
-            user = self.user_db_service.search_user(token=token, search_field="user_name", search_value=user_name)
+            user = await self.user_db_service.search_user(token=token, search_field="user_name", search_value=user_name)
             # Extract User Id
-            list_of_devices = self.user_db_service.search_device(token=token, search_field="owner_id", search_value=user.user_id)
+            list_of_devices = await self.user_db_service.search_device(token=token, search_field="owner_id", search_value=user.user_id)
             # Get all devices with owner_id = user_id
             list_of_devices_names = [device.device_name for device in list_of_devices]
             return DeviceListResponse(user_name=user_name, devices_list=list_of_devices_names)
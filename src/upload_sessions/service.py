@@ -0,0 +1,164 @@
+import logging
+logger = logging.getLogger(__name__)
+import os
+import shutil
+import threading
+from typing import BinaryIO
+from uuid import uuid4
+from datetime import datetime, timedelta
+from pydantic import BaseModel, Field
+
+class UploadSession(BaseModel):
+    session_id: str = Field(default_factory=lambda:str(uuid4()))
+    media_id: str
+    device_id: str
+    total_size: int
+    received_size: int = 0
+    overwrite: bool = False
+    finalizing: bool = False # The received bytes are being processed, the session doesn't accept chunks
+    created_on: datetime = Field(default_factory=datetime.now)
+    updated_on: datetime = Field(default_factory=datetime.now)
+
+class UploadSessionOffsetError(Exception):
+    def __init__(self, message: str, received_size: int) -> None:
+        super().__init__(message)
+        self.received_size = received_size
+
+class UploadSessionFinalizingError(Exception):
+    pass
+
+class UploadSessionService:
+    """Keep resumable uploads in a local spool until all their bytes were received
+
+    Every session has a data file with the received bytes and a metadata file, so an interrupted
+    client (or a restarted service) can continue from received_size instead of starting over.
+    Sessions that weren't updated for session_ttl_hours are removed
+    """
+
+    def __init__(self,
+                 spool_location: str,
+                 session_ttl_hours: int=24,
+                 copy_chunk_size: int=1024*1024) -> None:
+        self.sessions_location = os.path.join(spool_location, "sessions")
+        self.session_ttl = timedelta(hours=session_ttl_hours)
+        self.copy_chunk_size = copy_chunk_size
+        os.makedirs(self.sessions_location, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sessions_locks: dict[str, threading.Lock] = {}
+
+    def create(self, media_id: str, device_id: str, total_size: int, overwrite: bool=False) -> UploadSession:
+        if total_size <= 0:
+            raise AttributeError("total_size must be positive")
+        self.__remove_expired_sessions__()
+        new_session = UploadSession(media_id=media_id, device_id=device_id, total_size=total_size, overwrite=overwrite)
+        open(self.get_data_path(new_session.session_id), "wb").close()
+        self.__save__(new_session)
+        return new_session
+
+    def get(self, session_id: str) -> UploadSession | None:
+        metadata_path = self.__get_metadata_path__(session_id)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path, "r") as metadata_file:
+            return UploadSession.model_validate_json(metadata_file.read())
+
+    def append_chunk(self, session_id: str, offset: int, chunk_file: BinaryIO) -> UploadSession:
+        """Write the chunk at offset. A chunk may repeat bytes that were already received (client retry),
+        but it can't leave a gap after received_size
+        """
+        with self.__get_session_lock__(session_id):
+            upload_session = self.get(session_id)
+            if upload_session is None:
+                raise FileNotFoundError(f"Upload session {session_id} was not found")
+            if upload_session.finalizing:
+                raise UploadSessionFinalizingError(f"Upload session {session_id} is being finalized")
+            if offset < 0 or offset > upload_session.received_size:
+                raise UploadSessionOffsetError(f"Expected a chunk at offset {upload_session.received_size}, got {offset}",
+                                               received_size=upload_session.received_size)
+            chunk_end = offset + chunk_file.seek(0, os.SEEK_END)
+            if chunk_end > upload_session.total_size:
+                raise UploadSessionOffsetError(f"The chunk ends at {chunk_end}, after the total size {upload_session.total_size}",
+                                               received_size=upload_session.received_size)
+            with open(self.get_data_path(session_id), "r+b") as data_file:
+                data_file.seek(offset)
+                chunk_file.seek(0)
+                shutil.copyfileobj(chunk_file, data_file, self.copy_chunk_size)
+            upload_session.received_size = max(upload_session.received_size, chunk_end)
+            upload_session.updated_on = datetime.now()
+            self.__save__(upload_session)
+            return upload_session
+
+    def begin_finalize(self, session_id: str) -> UploadSession:
+        """Mark a complete session as finalizing, so its data file can't change and it isn't finalized twice
+        """
+        with self.__get_session_lock__(session_id):
+            upload_session = self.get(session_id)
+            if upload_session is None:
+                raise FileNotFoundError(f"Upload session {session_id} was not found")
+            if upload_session.finalizing:
+                raise UploadSessionFinalizingError(f"Upload session {session_id} is already being finalized")
+            if not self.is_complete(upload_session):
+                raise UploadSessionOffsetError(f"Received {upload_session.received_size} of {upload_session.total_size} bytes",
+                                               received_size=upload_session.received_size)
+            upload_session.finalizing = True
+            upload_session.updated_on = datetime.now()
+            self.__save__(upload_session)
+            return upload_session
+
+    def cancel_finalize(self, session_id: str):
+        # The finalize failed, the session accepts chunks and can be finalized again
+        with self.__get_session_lock__(session_id):
+            upload_session = self.get(session_id)
+            if upload_session is None:
+                return
+            upload_session.finalizing = False
+            upload_session.updated_on = datetime.now()
+            self.__save__(upload_session)
+
+    def is_complete(self, upload_session: UploadSession) -> bool:
+        return upload_session.received_size == upload_session.total_size
+
+    def get_data_path(self, session_id: str) -> str:
+        return os.path.join(self.sessions_location, f"{session_id}.part")
+
+    def remove(self, session_id: str, keep_data: bool=False):
+        """Remove the session. With keep_data the data file stays for whoever took ownership of it
+        """
+        with self.__get_session_lock__(session_id):
+            for file_path in [self.__get_metadata_path__(session_id)] + ([] if keep_data else [self.get_data_path(session_id)]):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+        with self.lock:
+            self.sessions_locks.pop(session_id, None)
+
+    def __get_metadata_path__(self, session_id: str) -> str:
+        # The session id is used as a file name, so it must not contain a path
+        if os.path.basename(session_id) != session_id:
+            raise FileNotFoundError(f"Upload session {session_id} was not found")
+        return os.path.join(self.sessions_location, f"{session_id}.json")
+
+    def __save__(self, upload_session: UploadSession):
+        metadata_path = self.__get_metadata_path__(upload_session.session_id)
+        with open(metadata_path+".tmp", "w") as metadata_file:
+            metadata_file.write(upload_session.model_dump_json())
+        os.replace(metadata_path+".tmp", metadata_path)
+
+    def __get_session_lock__(self, session_id: str) -> threading.Lock:
+        with self.lock:
+            if not session_id in self.sessions_locks:
+                self.sessions_locks[session_id] = threading.Lock()
+            return self.sessions_locks[session_id]
+
+    def __remove_expired_sessions__(self):
+        expiration_time = datetime.now() - self.session_ttl
+        for file_name in os.listdir(self.sessions_location):
+            if not file_name.endswith(".json"):
+                continue
+            session_id = file_name[:-len(".json")]
+            try:
+                upload_session = self.get(session_id)
+                if upload_session and upload_session.updated_on < expiration_time:
+                    logger.info(f"Remove expired upload session {session_id}")
+                    self.remove(session_id)
+            except Exception as err:
+                logger.warning(f"Failed to check upload session {session_id}: {str(err)}")
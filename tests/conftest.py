@@ -17,9 +17,9 @@ from routes.media import ImageRequest
 
 @pytest.fixture(scope="session")
 def client_fixture():
-    client = TestClient(app)
-    yield client
-    client.close()
+    # The context manager keeps one event loop for all the requests of the session
+    with TestClient(app) as client:
+        yield client
 
 @pytest.fixture(scope="session")
 def original_service_uri_fixture():
@@ -0,0 +1,78 @@
+import pytest
+import asyncio
+import threading
+import time
+
+from db.media_service import MediaDBService, AsyncMediaDBService
+from models.media import SearchResult, MediaDB
+from authentication.models import Token
+
+PAGE_DELAY = 0.05
+
+@pytest.fixture(scope="module")
+def media_list_fixture(search_result_fixture):
+    media_list = [MediaDB(**media) for media in search_result_fixture["results"]]
+    return (media_list*30)[:103]
+
+def get_page(media_list, page_size, page_number) -> SearchResult:
+    return SearchResult(total_results_number=len(media_list),
+                        page_number=page_number,
+                        page_size=page_size,
+                        results=media_list[page_number*page_size:(page_number+1)*page_size])
+
+def test_search_media_all(media_list_fixture, monkeypatch):
+    # SETUP
+    media_db_service = MediaDBService(host="localhost", port=1, parallel_pages=4)
+    active_requests = []
+    max_active_requests = []
+    lock = threading.Lock()
+    def search_media(token, page_size, page_number, **kargs):
+        with lock:
+            active_requests.append(page_number)
+            max_active_requests.append(len(active_requests))
+        time.sleep(PAGE_DELAY)
+        with lock:
+            active_requests.remove(page_number)
+        return get_page(media_list_fixture, page_size, page_number)
+    monkeypatch.setattr(media_db_service, "search_media", search_media)
+
+    # RUN
+    results = list(media_db_service.search_media_all(token=Token(access_token="", token_type="bearer"), page_size=10, device_id="device"))
+
+    # ASSERT
+    assert [media.media_id for media in results] == [media.media_id for media in media_list_fixture]
+    # 11 pages - the first alone and the rest up to 4 at a time
+    assert 1 < max(max_active_requests) <= 4
+
+def test_async_search_media_all(media_list_fixture, monkeypatch):
+    # SETUP
+    media_db_service = AsyncMediaDBService(host="localhost", port=1, parallel_pages=4)
+    active_requests = []
+    max_active_requests = []
+    async def search_media(token, page_size, page_number, **kargs):
+        active_requests.append(page_number)
+        max_active_requests.append(len(active_requests))
+        await asyncio.sleep(PAGE_DELAY)
+        active_requests.remove(page_number)
+        return get_page(media_list_fixture, page_size, page_number)
+    monkeypatch.setattr(media_db_service, "search_media", search_media)
+
+    async def scan():
+        return [media async for media in media_db_service.search_media_all(token=Token(access_token="", token_type="bearer"), page_size=10)]
+
+    # RUN
+    results = asyncio.run(scan())
+
+    # ASSERT
+    assert [media.media_id for media in results] == [media.media_id for media in media_list_fixture]
+    assert 1 < max(max_active_requests) <= 4
+
+def test_parse_search_response(search_result_fixture):
+    # SETUP
+    response_content = SearchResult(**search_result_fixture).model_dump_json().encode()
+
+    # RUN
+    search_result = MediaDBService.__parse_search_response__(200, response_content, None)
+
+    # ASSERT
+    assert search_result == SearchResult(**search_result_fixture)
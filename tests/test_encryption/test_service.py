@@ -1,19 +1,31 @@
 import pytest
 import io
+import hashlib
+import base64
+import zlib
 from PIL import Image
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.fernet import Fernet
 
-from encryption.service import EncryptService
+from encryption.service import EncryptService, COMPRESSION_NONE, COMPRESSIONS_IDS
 
 @pytest.fixture(scope="module")
 def encrypt_service_fixture():
     return EncryptService(public_key_location="/temp/data.pub",
                           private_key_location="/temp/data")
 
+def prepare_legacy_encryptor(encrypt_service: EncryptService):
+    # The Fernet encryptor of the values that were encrypted before the envelope format
+    symmetric_key = Fernet.generate_key()
+    encrypted_key = encrypt_service.public_key.encrypt(symmetric_key, encrypt_service.padding_function)
+    return Fernet(symmetric_key), encrypted_key
+
 def test_symmetic_encryption_text(encrypt_service_fixture: EncryptService):
     # SETUP
 
     message = b"What am I?"
-    result_encryptor, result_key = encrypt_service_fixture.__prepare_encryptor__()
+    result_encryptor, result_key = prepare_legacy_encryptor(encrypt_service_fixture)
     
     # RUN
     encrypted_message = result_encryptor.encrypt(message)
@@ -31,7 +43,7 @@ def test_symmetic_encryption_image(encrypt_service_fixture: EncryptService, test
     image_file.save(image_bytes, format=image_file.format)
     image_bytes_array = image_bytes.getvalue()
     image_bytes.close()
-    result_encryptor, result_key = encrypt_service_fixture.__prepare_encryptor__()
+    result_encryptor, result_key = prepare_legacy_encryptor(encrypt_service_fixture)
 
     # RUN
     encrypted_image = result_encryptor.encrypt(image_bytes_array)
@@ -56,4 +68,119 @@ def test_encryption(encrypt_service_fixture: EncryptService, test_images_list):
     # ASSERT
 
     for key, value in values_to_encrypt.items():
-        result_decrypted_values[key]=value
\ No newline at end of file
+        result_decrypted_values[key]=value
+
+def test_encryption_stream(encrypt_service_fixture: EncryptService, test_images_list):
+    # SETUP
+    with open(test_images_list[1], 'rb') as image_file:
+        image_bytes = image_file.read()
+    values_to_encrypt={}
+    values_to_encrypt["image"]=io.BytesIO(image_bytes)
+    values_to_encrypt["thumbnail"]=b"But you can't here it"
+
+    # RUN
+    encrypted_values, encrypted_key = encrypt_service_fixture.encrypt(values_to_encrypt)
+    encrypted_values["image"] = b"".join(encrypted_values["image"])
+
+    result_decrypted_values = encrypt_service_fixture.decrypt(encrypted_key,encrypted_values)
+
+    # ASSERT
+    assert result_decrypted_values["image"] == image_bytes
+    assert result_decrypted_values["thumbnail"] == values_to_encrypt["thumbnail"]
+
+def test_get_content_hash(encrypt_service_fixture: EncryptService, test_images_list):
+    # SETUP
+    with open(test_images_list[0], 'rb') as image_file:
+        image_bytes = image_file.read()
+
+    # RUN
+    content_hash = encrypt_service_fixture.get_content_hash(io.BytesIO(image_bytes))
+
+    # ASSERT
+    assert content_hash == hashlib.sha256(image_bytes).hexdigest()
+
+@pytest.mark.parametrize("cipher", ["AES-GCM", "CHACHA20-POLY1305"])
+def test_encryption_envelope(cipher, test_images_list):
+    # SETUP
+    encrypt_service = EncryptService(public_key_location="/temp/data.pub",
+                                     private_key_location="/temp/data",
+                                     chunk_size=64*1024,
+                                     cipher=cipher)
+    with open(test_images_list[1], 'rb') as image_file:
+        image_bytes = image_file.read()
+
+    # RUN
+    encrypted_values, encrypted_key = encrypt_service.encrypt({"image": image_bytes})
+    encrypted_stream, stream_encrypted_key = encrypt_service.encrypt_stream(io.BytesIO(image_bytes))
+    decrypted_stream = b"".join(encrypt_service.decrypt_stream(stream_encrypted_key, io.BytesIO(b"".join(encrypted_stream))))
+
+    # ASSERT
+    # Raw binary output - not larger than the (already compressed) image and the framing overhead
+    assert len(encrypted_values["image"]) < len(image_bytes)*1.01 + 1024
+    assert encrypt_service.decrypt(encrypted_key, encrypted_values)["image"] == image_bytes
+    assert decrypted_stream == image_bytes
+
+def test_decrypt_legacy_fernet(encrypt_service_fixture: EncryptService):
+    # SETUP
+    message = b"What am I?"
+    legacy_encryptor, legacy_encrypted_key = prepare_legacy_encryptor(encrypt_service_fixture)
+    legacy_values = {"thumbnail": "b64:"+base64.b64encode(legacy_encryptor.encrypt(zlib.compress(message))).decode()}
+
+    # RUN
+    decrypted_values = encrypt_service_fixture.decrypt(base64.b64encode(legacy_encrypted_key).decode(), legacy_values)
+
+    # ASSERT
+    assert decrypted_values["thumbnail"] == message
+
+@pytest.mark.parametrize("compression", ["NONE", "ZLIB", "ZSTD"])
+def test_encryption_compression(compression, test_images_list):
+    # SETUP
+    encrypt_service = EncryptService(public_key_location="/temp/data.pub",
+                                     private_key_location="/temp/data",
+                                     compression=compression)
+    with open(test_images_list[1], 'rb') as image_file:
+        image_bytes = image_file.read()
+    text_bytes = b"An EXIF dump that compresses well. "*1000
+
+    # RUN
+    encrypted_values, encrypted_key = encrypt_service.encrypt({"image": image_bytes, "text": text_bytes})
+    decrypted_values = encrypt_service.decrypt(encrypted_key, encrypted_values)
+
+    # ASSERT
+    assert encrypt_service.get_compression(image_bytes[:1024]) == COMPRESSION_NONE
+    assert encrypt_service.get_compression(text_bytes) == COMPRESSIONS_IDS[compression]
+    assert decrypted_values["image"] == image_bytes
+    assert decrypted_values["text"] == text_bytes
+
+def test_decrypt_many(encrypt_service_fixture: EncryptService):
+    # SETUP
+    thumbnails = [f"thumbnail number {thumbnail_index}".encode() for thumbnail_index in range(20)]
+    encrypted_items = []
+    for thumbnail in thumbnails:
+        encrypted_values, encrypted_key = encrypt_service_fixture.encrypt({"thumbnail": thumbnail})
+        encrypted_items.append((encrypted_key, encrypted_values))
+
+    # RUN
+    decrypted_items = encrypt_service_fixture.decrypt_many(encrypted_items)
+
+    # ASSERT
+    assert [decrypted_values["thumbnail"] for decrypted_values in decrypted_items] == thumbnails
+
+def test_private_key_reload(tmp_path):
+    # SETUP
+    private_key_path = tmp_path / "data"
+    private_key_path.write_bytes(open("/temp/data", "rb").read())
+    encrypt_service = EncryptService(public_key_location="/temp/data.pub", private_key_location=str(private_key_path))
+    first_private_key = encrypt_service.__load_private_key__()
+    new_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    # RUN
+    second_private_key = encrypt_service.__load_private_key__()
+    private_key_path.write_bytes(new_private_key.private_bytes(serialization.Encoding.PEM,
+                                                               serialization.PrivateFormat.PKCS8,
+                                                               serialization.NoEncryption()))
+    reloaded_private_key = encrypt_service.__load_private_key__()
+
+    # ASSERT
+    assert second_private_key is first_private_key
+    assert reloaded_private_key.private_numbers() == new_private_key.private_numbers()
@@ -0,0 +1,94 @@
+import pytest
+import asyncio
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from http_transport.service import HttpTransport, AsyncHttpTransport
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_GET(self):
+        KeepAliveHandler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def http_server_url():
+    server = HTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def test_connection_reuse(http_server_url):
+    # SETUP
+    transport = HttpTransport(pool_maxsize=2)
+    KeepAliveHandler.connections.clear()
+
+    # RUN
+    responses = [transport.get(http_server_url+"/") for _ in range(5)]
+
+    # ASSERT
+    assert all(response.status_code == 200 for response in responses)
+    assert len(KeepAliveHandler.connections) == 1
+
+def test_default_timeout(monkeypatch):
+    # SETUP
+    transport = HttpTransport(connect_timeout=1.5, read_timeout=7)
+    sent_timeouts = []
+    monkeypatch.setattr(transport.session, "request", lambda method, url, **kargs: sent_timeouts.append(kargs["timeout"]))
+
+    # RUN
+    transport.get("http://localhost/")
+    transport.put("http://localhost/", timeout=60)
+
+    # ASSERT
+    assert sent_timeouts == [(1.5, 7), 60]
+
+def test_async_connection_reuse(http_server_url):
+    # SETUP
+    transport = AsyncHttpTransport(pool_connections=1, pool_maxsize=1)
+    KeepAliveHandler.connections.clear()
+
+    async def send_requests():
+        responses = await asyncio.gather(*[transport.get(http_server_url+"/") for _ in range(5)])
+        await transport.close()
+        return responses
+
+    # RUN
+    responses = asyncio.run(send_requests())
+
+    # ASSERT
+    assert all(response.status_code == 200 for response in responses)
+    assert len(KeepAliveHandler.connections) == 1
+
+def test_async_transport_bound_to_loop(http_server_url):
+    # SETUP
+    transport = AsyncHttpTransport(pool_connections=1, pool_maxsize=1)
+    asyncio.run(transport.get(http_server_url+"/"))
+
+    # RUN
+    with pytest.raises(RuntimeError):
+        asyncio.run(transport.get(http_server_url+"/"))
+
+def test_async_transport_closed_new_loop(http_server_url):
+    # SETUP
+    transport = AsyncHttpTransport(pool_connections=1, pool_maxsize=1)
+
+    async def send_request():
+        response = await transport.get(http_server_url+"/")
+        await transport.close()
+        return response
+
+    # RUN
+    responses = [asyncio.run(send_request()) for _ in range(2)]
+
+    # ASSERT
+    assert all(response.status_code == 200 for response in responses)
@@ -0,0 +1,65 @@
+import pytest
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from PIL import Image, ExifTags, TiffImagePlugin
+
+from image_metadata.service import ImageMetadataService
+
+@pytest.fixture(scope="module")
+def image_metadata_service_fixture():
+    return ImageMetadataService()
+
+def create_image_file_with_exif():
+    image = Image.new("RGB", (300, 200), (120, 30, 200))
+    exif = image.getexif()
+    exif[ExifTags.Base.Orientation] = 6
+    exif[ExifTags.Base.Make] = "Google"
+    exif[ExifTags.Base.Model] = "Pixel 7"
+    exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+    exif_ifd[ExifTags.Base.DateTimeOriginal] = "2023:04:06 11:24:01"
+    exif_ifd[ExifTags.Base.OffsetTimeOriginal] = "+03:00"
+    exif_ifd[ExifTags.Base.ExposureTime] = TiffImagePlugin.IFDRational(1, 120)
+    gps_ifd = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    gps_ifd[ExifTags.GPS.GPSLatitudeRef] = "N"
+    gps_ifd[ExifTags.GPS.GPSLatitude] = (TiffImagePlugin.IFDRational(32), TiffImagePlugin.IFDRational(4), TiffImagePlugin.IFDRational(30))
+    gps_ifd[ExifTags.GPS.GPSLongitudeRef] = "W"
+    gps_ifd[ExifTags.GPS.GPSLongitude] = (TiffImagePlugin.IFDRational(34), TiffImagePlugin.IFDRational(46), TiffImagePlugin.IFDRational(48))
+    image_file = io.BytesIO()
+    image.save(image_file, format="JPEG", exif=exif.tobytes())
+    image_file.seek(0)
+    return image_file
+
+def test_extract(image_metadata_service_fixture: ImageMetadataService):
+    # SETUP
+    image_file = create_image_file_with_exif()
+
+    # RUN
+    image_metadata = image_metadata_service_fixture.extract(image_file)
+
+    # ASSERT
+    assert (image_metadata.width, image_metadata.height) == (300, 200)
+    assert image_metadata.display_size == (200, 300)
+    assert image_metadata.image_format == "JPEG"
+    assert image_metadata.orientation == 6
+    assert image_metadata.taken_at == datetime(2023, 4, 6, 11, 24, 1, tzinfo=timezone(timedelta(hours=3)))
+    assert image_metadata.location.latitude == pytest.approx(32.075)
+    assert image_metadata.location.longitude == pytest.approx(-34.78)
+    assert (image_metadata.camera.make, image_metadata.camera.model) == ("Google", "Pixel 7")
+    assert image_metadata.exif["ExposureTime"] == pytest.approx(1/120)
+    assert image_metadata.exif["GPSInfo"]["GPSLatitudeRef"] == "N"
+    json.dumps(image_metadata.exif)
+
+def test_extract_without_exif(image_metadata_service_fixture: ImageMetadataService, test_images_list):
+    # SETUP
+    with open(test_images_list[1], 'rb') as image_file:
+        # RUN
+        image_metadata = image_metadata_service_fixture.extract(image_file)
+
+    # ASSERT
+    assert (image_metadata.width, image_metadata.height) == (2048, 1536)
+    assert image_metadata.orientation is None
+    assert image_metadata.taken_at is None
+    assert image_metadata.location is None
+    assert image_metadata.camera is None
+    assert image_metadata.exif is None
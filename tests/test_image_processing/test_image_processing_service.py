@@ -0,0 +1,175 @@
+import pytest
+import io
+import threading
+from PIL import Image
+
+from image_processing.service import ImageProcessingService, ImageTooLargeError, MegapixelsBudget
+from image_processing.models import ThumbnailRendition
+from image_metadata.service import ImageMetadataService
+
+@pytest.fixture(scope="module")
+def image_processing_service_fixture():
+    return ImageProcessingService(thumbnail_width_size=400)
+
+def create_image_file(size, orientation=None):
+    image = Image.new("RGB", size, (120, 30, 200))
+    exif = image.getexif()
+    if orientation:
+        exif[0x0112] = orientation
+    image_file = io.BytesIO()
+    image.save(image_file, format="JPEG", exif=exif.tobytes())
+    image_file.seek(0)
+    return image_file
+
+def test_get_image_thumbnail_bytes(image_processing_service_fixture: ImageProcessingService, test_images_list):
+    # SETUP
+    with open(test_images_list[1], 'rb') as image_file:
+        # RUN
+        thumbnail_bytes, image_size, thumbnail_size, exif = image_processing_service_fixture.get_image_thumbnail_bytes(image_file)
+
+    # ASSERT
+    assert image_size == (2048, 1536)
+    assert thumbnail_size == (400, 300)
+    assert Image.open(io.BytesIO(thumbnail_bytes)).size == thumbnail_size
+
+def test_get_image_thumbnail_bytes_rotated(image_processing_service_fixture: ImageProcessingService):
+    # SETUP
+    image_file = create_image_file((3000, 1000), orientation=6)
+
+    # RUN
+    thumbnail_bytes, image_size, thumbnail_size, exif = image_processing_service_fixture.get_image_thumbnail_bytes(image_file)
+
+    # ASSERT
+    assert image_size == (1000, 3000)
+    assert thumbnail_size == (167, 500)
+
+def test_get_image_thumbnail_bytes_process_pool(image_processing_service_fixture: ImageProcessingService, test_images_list):
+    # SETUP
+    process_pool_service = ImageProcessingService(thumbnail_width_size=400, process_pool_size=1)
+    with open(test_images_list[1], 'rb') as image_file:
+        expected_result = image_processing_service_fixture.get_image_thumbnail_bytes(image_file)
+
+        # RUN
+        result = process_pool_service.get_image_thumbnail_bytes(image_file)
+
+    # ASSERT
+    assert result == expected_result
+
+def test_process_image_renditions(test_images_list):
+    # SETUP
+    renditions = ThumbnailRendition.parse_renditions("grid:256x256,preview:1024x1024,blur:32x32:2")
+    image_processing_service = ImageProcessingService(thumbnail_width_size=400, thumbnail_height_size=400, renditions=renditions)
+
+    # RUN
+    with open(test_images_list[1], 'rb') as image_file:
+        result = image_processing_service.process_image(image_file)
+
+    # ASSERT
+    assert (result.thumbnail.width, result.thumbnail.height) == (400, 300)
+    assert [(rendition.name, rendition.width, rendition.height) for rendition in result.renditions] == [("grid", 256, 192),
+                                                                                                        ("preview", 1024, 768),
+                                                                                                        ("blur", 32, 24)]
+    for rendition in result.renditions:
+        assert Image.open(io.BytesIO(rendition.data)).size == (rendition.width, rendition.height)
+
+def test_process_image_reads_header_once(monkeypatch):
+    # SETUP
+    image_processing_service = ImageProcessingService(thumbnail_width_size=400, megapixels_budget=100)
+    image_file = create_image_file((3000, 1000), orientation=6)
+    extracted_images = []
+    extract_from_image = ImageMetadataService.extract_from_image
+    def count_extract_from_image(image):
+        extracted_images.append(image)
+        return extract_from_image(image)
+    monkeypatch.setattr(ImageMetadataService, "extract_from_image", count_extract_from_image)
+
+    # RUN
+    result = image_processing_service.process_image(image_file)
+
+    # ASSERT
+    assert len(extracted_images) == 1
+    assert (result.thumbnail.width, result.thumbnail.height) == (167, 500)
+
+@pytest.mark.parametrize("renditions", ["thumbnail:256x256", "grid:256x256,grid:512x512", "grid:256", "grid", "grid:0x256", "grid:axb"])
+def test_parse_renditions_invalid(renditions):
+    # RUN
+    with pytest.raises(AttributeError):
+        ThumbnailRendition.parse_renditions(renditions)
+
+@pytest.mark.parametrize("thumbnail_format", ["WEBP", "JPEG"])
+def test_process_image_thumbnail_format(thumbnail_format):
+    # SETUP
+    image_processing_service = ImageProcessingService(thumbnail_width_size=400, thumbnail_format=thumbnail_format)
+    image_file = create_image_file((3000, 1000), orientation=6)
+
+    # RUN
+    result = image_processing_service.process_image(image_file)
+
+    # ASSERT
+    thumbnail_image = Image.open(io.BytesIO(result.thumbnail.data))
+    assert result.thumbnail.format == thumbnail_format
+    assert thumbnail_image.format == thumbnail_format
+    assert len(thumbnail_image.getexif()) == 0
+    assert result.exif["Orientation"] == 6
+
+def test_perceptual_hash_of_resized_image(test_images_list):
+    # SETUP
+    with Image.open(test_images_list[1]) as image:
+        image.load()
+    resized_image = image.resize((image.size[0]//3, image.size[1]//3))
+    other_image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+
+    # RUN
+    image_hash = int(ImageProcessingService.get_perceptual_hash(image), 16)
+    resized_image_hash = int(ImageProcessingService.get_perceptual_hash(resized_image), 16)
+    other_image_hash = int(ImageProcessingService.get_perceptual_hash(other_image), 16)
+
+    # ASSERT
+    assert bin(image_hash ^ resized_image_hash).count("1") <= 4
+    assert bin(image_hash ^ other_image_hash).count("1") > 10
+
+@pytest.mark.parametrize("image_format", ["BMP", "TIFF", "PPM"])
+def test_process_image_by_strips(image_format):
+    # SETUP
+    image = Image.linear_gradient("L").resize((1200, 900)).convert("RGB")
+    image_file = io.BytesIO()
+    image.save(image_file, format=image_format)
+    full_decode_service = ImageProcessingService(thumbnail_width_size=400)
+    strips_service = ImageProcessingService(thumbnail_width_size=400, strip_decode_megapixels=0.5, strip_megapixels=0.1)
+
+    # RUN
+    full_decode_result = full_decode_service.process_image(image_file)
+    strips_result = strips_service.process_image(image_file)
+
+    # ASSERT
+    assert (strips_result.thumbnail.width, strips_result.thumbnail.height) == (400, 300)
+    full_decode_thumbnail = Image.open(io.BytesIO(full_decode_result.thumbnail.data)).convert("L")
+    strips_thumbnail = Image.open(io.BytesIO(strips_result.thumbnail.data)).convert("L")
+    assert max(abs(first-second) for first, second in zip(full_decode_thumbnail.tobytes(), strips_thumbnail.tobytes())) <= 8
+
+def test_process_image_too_large(test_images_list):
+    # SETUP
+    image_processing_service = ImageProcessingService(max_image_megapixels=1)
+
+    # RUN + ASSERT
+    with open(test_images_list[1], 'rb') as image_file:
+        with pytest.raises(ImageTooLargeError):
+            image_processing_service.process_image(image_file)
+
+def test_megapixels_budget():
+    # SETUP
+    megapixels_budget = MegapixelsBudget(megapixels=1)
+    second_reserved = threading.Event()
+
+    def reserve_second():
+        with megapixels_budget.reserve(600_000):
+            second_reserved.set()
+
+    # RUN
+    with megapixels_budget.reserve(600_000):
+        second_thread = threading.Thread(target=reserve_second)
+        second_thread.start()
+        # ASSERT - the second image waits until the first one is done
+        assert not second_reserved.wait(0.2)
+    second_thread.join(5)
+    assert second_reserved.is_set()
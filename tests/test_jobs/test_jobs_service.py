@@ -0,0 +1,27 @@
+import io
+import time
+import threading
+
+from jobs.service import UploadJobService, UploadJobStatus
+
+def test_close_waits_for_running_jobs(tmp_path):
+    # SETUP
+    upload_job_service = UploadJobService(spool_location=str(tmp_path), workers_number=1)
+    job_started = threading.Event()
+    def slow_process_function(spool_file):
+        job_started.set()
+        time.sleep(0.2)
+    running_job = upload_job_service.submit(media_id="media_1",
+                                            spool_path=upload_job_service.spool_file(io.BytesIO(b"image")),
+                                            process_function=slow_process_function)
+    queued_job = upload_job_service.submit(media_id="media_2",
+                                           spool_path=upload_job_service.spool_file(io.BytesIO(b"image")),
+                                           process_function=slow_process_function)
+    job_started.wait()
+
+    # RUN
+    upload_job_service.close()
+
+    # ASSERT
+    assert upload_job_service.get(running_job.job_id).status == UploadJobStatus.DONE
+    assert upload_job_service.get(queued_job.job_id).status == UploadJobStatus.PENDING
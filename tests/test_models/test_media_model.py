@@ -0,0 +1,121 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+
+from models.media import MediaDB, MediaRequest
+
+def test_sql_select_item_order_and_limit():
+    # RUN
+    sql_template, values = MediaDB.__sql_select_item__(["device_id"], [["device_1"]], "test",
+                                                       order_by=["created_on"], descending=True, limit=1)
+
+    # ASSERT
+    assert sql_template == "SELECT * FROM medias_test WHERE device_id IN (%s) ORDER BY created_on DESC LIMIT %s"
+    assert values == ("device_1", 1)
+
+def test_sql_select_item_order_by_unknown_field():
+    # RUN + ASSERT
+    with pytest.raises(AttributeError):
+        MediaDB.__sql_select_item__(["device_id"], [["device_1"]], "test", order_by=["created_on; DROP TABLE"])
+
+def test_sql_select_item_keyset_page():
+    # RUN
+    sql_template, values = MediaDB.__sql_select_item__(["device_id", "upload_status"], [["device_1"], ["PENDING"]], "test",
+                                                       order_by=["created_on", "media_id"], descending=True,
+                                                       keyset_values=["2023-12-07T19:17:05", "media_1"], limit=200)
+
+    # ASSERT
+    assert sql_template == ("SELECT * FROM medias_test WHERE device_id IN (%s) AND upload_status IN (%s)"
+                            " AND (created_on,media_id) < (%s,%s) ORDER BY created_on DESC,media_id DESC LIMIT %s")
+    assert values == ("device_1", "PENDING", "2023-12-07T19:17:05", "media_1", 200)
+
+def test_sql_insert_batch(search_result_fixture):
+    # SETUP
+    medias = [MediaDB(**media) for media in search_result_fixture["results"][0:3]]
+
+    # RUN
+    sql_template, values = MediaDB.__sql_insert_batch__(medias, "test")
+
+    # ASSERT
+    columns_number = sql_template[sql_template.index("(")+1:sql_template.index(")")].count(",")+1
+    assert sql_template.count("),(") == len(medias)-1
+    assert sql_template.endswith("ON CONFLICT DO NOTHING RETURNING media_id")
+    assert len(values) == columns_number*len(medias)
+
+def test_sql_insert_batch_falsy_values(search_result_fixture):
+    # SETUP
+    medias = [MediaDB(**dict(search_result_fixture["results"][0], media_size_bytes=0, media_description="", orientation=0)),
+              MediaDB(**search_result_fixture["results"][1])]
+
+    # RUN
+    sql_template, values = MediaDB.__sql_insert_batch__(medias, "test")
+
+    # ASSERT
+    columns = sql_template[sql_template.index("(")+1:sql_template.index(")")].split(",")
+    first_row = dict(zip(columns, values[:len(columns)]))
+    assert first_row["media_size_bytes"] == 0
+    assert first_row["media_description"] == ""
+    assert first_row["orientation"] == 0
+    assert values[len(columns)+columns.index("orientation")] is None
+
+def test_sql_migrate_table():
+    # RUN
+    migrations = MediaDB.__sql_migrate_table__("test")
+
+    # ASSERT
+    create_table = MediaDB.__sql_create_table__("test")
+    assert "ALTER TABLE medias_test ADD COLUMN IF NOT EXISTS taken_at TIMESTAMP" in migrations
+    for column_definition in [migration.split("ADD COLUMN IF NOT EXISTS ")[1] for migration in migrations]:
+        assert column_definition+"," in create_table or column_definition+"\n" in create_table
+
+def test_sql_select_item_range():
+    # RUN
+    sql_template, values = MediaDB.__sql_select_item__(["camera_make"], [["Google"]], "test",
+                                                       range_conditions={"taken_at": ["2023-01-01", "2023-12-31"],
+                                                                         "latitude": [None, "32.5"]})
+
+    # ASSERT
+    assert sql_template == "SELECT * FROM medias_test WHERE camera_make IN (%s) AND taken_at >= %s AND taken_at <= %s AND latitude <= %s"
+    assert values == ("Google", "2023-01-01", "2023-12-31", "32.5")
+
+def test_sql_select_item_range_unknown_field():
+    # RUN + ASSERT
+    with pytest.raises(AttributeError):
+        MediaDB.__sql_select_item__([], [], "test", range_conditions={"taken_at >= 0 OR 1": [0, None]})
+
+def test_sql_select_item_fields():
+    # RUN
+    sql_template, values = MediaDB.__sql_select_item__(["device_id"], [["device_1"]], "test", fields=["media_id", "device_media_uri"])
+
+    # ASSERT
+    assert sql_template == "SELECT media_id,device_media_uri FROM medias_test WHERE device_id IN (%s)"
+    assert values == ("device_1",)
+    with pytest.raises(AttributeError):
+        MediaDB.__sql_select_item__([], [], "test", fields=["media_id FROM users_test --"])
+
+def test_projection_model(search_result_fixture):
+    # SETUP
+    media = search_result_fixture["results"][0]
+
+    # RUN
+    projection_model = MediaDB.get_projection_model(("media_id", "created_on"))
+    projected_media = projection_model(media_id=media["media_id"], created_on=media["created_on"])
+
+    # ASSERT
+    assert list(projection_model.model_fields) == ["media_id", "created_on"]
+    assert projected_media.created_on == MediaDB(**media).created_on
+    assert MediaDB.get_projection_model(("media_id", "created_on")) is projection_model
+
+def test_taken_at_wall_time(search_result_fixture):
+    # SETUP
+    media = search_result_fixture["results"][0]
+
+    # RUN
+    media_with_offset = MediaDB(**dict(media, taken_at="2023-06-01T10:30:00+03:00"))
+    media_without_offset = MediaDB(**dict(media, taken_at="2023-06-01T10:30:00"))
+
+    # ASSERT
+    assert media_with_offset.taken_at == datetime(2023, 6, 1, 10, 30)
+    assert media_with_offset.taken_at.tzinfo is None
+    assert media_with_offset.taken_at == media_without_offset.taken_at
+    # The assignment in __set_metadata_columns__ isn't validated, so it converts with the validator
+    assert MediaRequest.to_wall_time(datetime(2023, 6, 1, 10, 30, tzinfo=timezone(timedelta(hours=3)))) == datetime(2023, 6, 1, 10, 30)
@@ -0,0 +1,74 @@
+import pytest
+import random
+import threading
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from authentication.models import Token
+from near_duplicates.service import BKTree, NearDuplicateIndexService, hamming_distance
+
+def test_bk_tree_search():
+    # SETUP
+    random_generator = random.Random(7)
+    hashes = [random_generator.getrandbits(64) for _ in range(2000)]
+    bk_tree = BKTree()
+    for hash_index, perceptual_hash in enumerate(hashes):
+        bk_tree.add(perceptual_hash, f"media_{hash_index}")
+    query_hash = hashes[0] ^ 0b1011 # 3 bits away from media_0
+
+    # RUN
+    results = bk_tree.search(query_hash, max_distance=20)
+
+    # ASSERT
+    expected_results = [(f"media_{hash_index}", hamming_distance(query_hash, perceptual_hash)) 
+                        for hash_index, perceptual_hash in enumerate(hashes) if hamming_distance(query_hash, perceptual_hash) <= 20]
+    assert sorted(results) == sorted(expected_results)
+    assert ("media_0", 3) in results
+
+def test_bk_tree_identical_hashes():
+    # SETUP
+    bk_tree = BKTree()
+    bk_tree.add(0xff, "media_1")
+    bk_tree.add(0xff, "media_2")
+
+    # RUN
+    results = bk_tree.search(0xfe, max_distance=1)
+
+    # ASSERT
+    assert sorted(results) == [("media_1", 1), ("media_2", 1)]
+
+class FakeMediaDBService:
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.scans_number = 0
+
+    def search_media_all(self, token, **kargs):
+        self.scans_number += 1
+        time.sleep(0.1)
+        for hash_index, perceptual_hash in enumerate(self.hashes):
+            yield SimpleNamespace(media_id=f"media_{hash_index}", perceptual_hash=f"{perceptual_hash:016x}")
+
+def test_index_concurrent_find_and_add():
+    # SETUP
+    random_generator = random.Random(7)
+    media_db_service = FakeMediaDBService([random_generator.getrandbits(64) for _ in range(20000)])
+    index_service = NearDuplicateIndexService(media_db_service=media_db_service)
+    token = Token(access_token="", token_type="bearer")
+    query_hash = f"{media_db_service.hashes[0]:016x}"
+    def add_hashes():
+        for hash_index in range(20000):
+            index_service.add("owner", f"new_media_{hash_index}", f"{random_generator.getrandbits(64):016x}")
+
+    # RUN
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first_finds = [executor.submit(index_service.find, token, "owner", "media_0", query_hash, 10) for _ in range(3)]
+        [find.result() for find in first_finds]
+        adder = executor.submit(add_hashes)
+        finds = [executor.submit(index_service.find, token, "owner", "media_0", query_hash, 32) for _ in range(20)]
+        adder.result()
+        results = [find.result() for find in finds]
+
+    # ASSERT
+    assert media_db_service.scans_number == 1
+    assert all(len(result) > 0 for result in results)
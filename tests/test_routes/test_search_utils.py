@@ -0,0 +1,25 @@
+from routes.search_utils import extract_search_params_from_request, extract_search_control_from_request, SEARCH_CONTROL_PARAMS
+
+def test_extract_range_conditions():
+    # SETUP
+    query_params = [("camera_make", "Google"), ("taken_at__min", "2023-01-01"), ("taken_at__max", "2023-12-31"), ("latitude__max", "32.5")]
+
+    # RUN
+    search_params = extract_search_params_from_request(query_params, SEARCH_CONTROL_PARAMS)
+    search_control = extract_search_control_from_request(query_params)
+
+    # ASSERT
+    assert search_params == {"camera_make": ["Google"]}
+    assert search_control["range_conditions"] == {"taken_at": ["2023-01-01", "2023-12-31"], "latitude": [None, "32.5"]}
+
+def test_extract_fields():
+    # SETUP
+    query_params = [("device_id", "device_1"), ("fields", "media_id"), ("fields", "device_media_uri")]
+
+    # RUN
+    search_params = extract_search_params_from_request(query_params, SEARCH_CONTROL_PARAMS)
+    search_control = extract_search_control_from_request(query_params)
+
+    # ASSERT
+    assert search_params == {"device_id": ["device_1"]}
+    assert search_control["fields"] == ["media_id", "device_media_uri"]
@@ -0,0 +1,49 @@
+import io
+import pytest
+
+from upload_sessions.service import UploadSessionService, UploadSessionOffsetError, UploadSessionFinalizingError
+
+def test_finalizing_session_rejects_chunks_and_finalize(tmp_path):
+    # SETUP
+    upload_session_service = UploadSessionService(spool_location=str(tmp_path))
+    upload_session = upload_session_service.create(media_id="media_1", device_id="device_1", total_size=4)
+    upload_session_service.append_chunk(upload_session.session_id, offset=0, chunk_file=io.BytesIO(b"abcd"))
+
+    # RUN
+    finalizing_session = upload_session_service.begin_finalize(upload_session.session_id)
+
+    # ASSERT
+    assert finalizing_session.finalizing
+    assert upload_session_service.get(upload_session.session_id).finalizing
+    with pytest.raises(UploadSessionFinalizingError):
+        upload_session_service.append_chunk(upload_session.session_id, offset=0, chunk_file=io.BytesIO(b"ab"))
+    with pytest.raises(UploadSessionFinalizingError):
+        upload_session_service.begin_finalize(upload_session.session_id)
+
+def test_cancel_finalize(tmp_path):
+    # SETUP
+    upload_session_service = UploadSessionService(spool_location=str(tmp_path))
+    upload_session = upload_session_service.create(media_id="media_1", device_id="device_1", total_size=4)
+    upload_session_service.append_chunk(upload_session.session_id, offset=0, chunk_file=io.BytesIO(b"abcd"))
+    upload_session_service.begin_finalize(upload_session.session_id)
+
+    # RUN
+    upload_session_service.cancel_finalize(upload_session.session_id)
+
+    # ASSERT
+    assert not upload_session_service.get(upload_session.session_id).finalizing
+    assert upload_session_service.begin_finalize(upload_session.session_id).finalizing
+
+def test_begin_finalize_incomplete_session(tmp_path):
+    # SETUP
+    upload_session_service = UploadSessionService(spool_location=str(tmp_path))
+    upload_session = upload_session_service.create(media_id="media_1", device_id="device_1", total_size=4)
+    upload_session_service.append_chunk(upload_session.session_id, offset=0, chunk_file=io.BytesIO(b"ab"))
+
+    # RUN
+    with pytest.raises(UploadSessionOffsetError) as err:
+        upload_session_service.begin_finalize(upload_session.session_id)
+
+    # ASSERT
+    assert err.value.received_size == 2
+    assert not upload_session_service.get(upload_session.session_id).finalizing